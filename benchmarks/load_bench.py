@@ -0,0 +1,248 @@
+'''
+End-to-end HTTP load test for authenticated dashboard traffic.  Seeds a
+local database from data/keeneland.csv with DataLoader (reused between runs
+unless --reseed), serves create_app() on a local threaded WSGI server, then
+registers and logs in virtual users through the real forms and has each one
+request a weighted mix of pages.  Reports throughput, latency percentiles,
+error rates, and database queries per request for every page, and can save
+the results as JSON to compare across versions.  Runs entirely offline;
+the virtual users' random choices are seeded so every run issues the same
+requests.
+
+Usage:
+  python -m benchmarks.load_bench [--users 16] [--requests 50]
+      [--mix /=4,/aggregates/sires=2,/aggregates/jockeys=2,/aggregates/trainers=2]
+      [--db /tmp/data_barn_load.db] [--uri postgresql://...] [--reseed]
+      [--rows 5295] [--seed 1] [--json results.json]
+'''
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from flask import has_request_context, request
+from sqlalchemy import event, make_url
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+from werkzeug.serving import make_server
+
+DEFAULT_MIX = "/=4,/aggregates/sires=2,/aggregates/jockeys=2," + \
+    "/aggregates/trainers=2"
+
+@compiles(UUID, "sqlite")
+def _sqlite_uuid(type_, compiler, **kw):
+  # Lets the PostgreSQL models create tables in the default SQLite database.
+  return "CHAR(32)"
+
+def percentile(samples: list[float], pct: float) -> float:
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def seed(app, rows: int) -> None:
+  from data_barn import db, models
+  from load_data import DataLoader
+
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+    db.session.add(models.Track(abbreviation = "KEE", name = "Keeneland"))
+    db.session.commit()
+    loader = DataLoader(os.path.join("data", "keeneland.csv"))
+    loader.entries = loader.entries[:rows]
+    loader.batch_process()
+
+
+class QueryCounter(object):
+  '''
+  Counts statements per request path from inside the app's engines, so
+  queries are attributed exactly even with many requests in flight.
+  '''
+  def __init__(self, engines) -> None:
+    self.counts = {}
+    self._lock = threading.Lock()
+    for engine in engines:
+      event.listen(engine, "after_cursor_execute", self._count)
+
+  def _count(self, conn, cursor, statement, params, context, many) -> None:
+    if has_request_context():
+      with self._lock:
+        self.counts[request.path] = self.counts.get(request.path, 0) + 1
+
+  def reset(self) -> dict[str, int]:
+    with self._lock:
+      counts, self.counts = self.counts, {}
+
+    return counts
+
+
+class VirtualUser(object):
+  '''
+  One browser: its own cookie jar, a registered account, and a seeded
+  random stream of page choices.
+  '''
+  CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+  def __init__(self, base: str, name: str, rng: random.Random) -> None:
+    self.base = base
+    self.name = name
+    self.rng = rng
+    self.opener = urllib.request.build_opener( \
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+  def fetch(self, path: str, form: dict | None = None) -> tuple[int, str]:
+    data = urllib.parse.urlencode(form).encode() if form is not None \
+        else None
+    try:
+      with self.opener.open(self.base + path, data, timeout = 60) as response:
+        return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+      return e.code, e.read().decode()
+
+  def submit(self, path: str, form: dict) -> tuple[int, str]:
+    status, page = self.fetch(path)
+    token = self.CSRF.search(page)
+    if token:
+      form = dict(form, csrf_token = token.group(1))
+
+    return self.fetch(path, form)
+
+  def sign_up(self) -> bool:
+    form = {"username": self.name, "password": "load test password"}
+    self.submit("/auth/register", form)
+    status, page = self.submit("/auth/login", form)
+
+    return status == 200 and "Sign out" in page
+
+
+def run(base: str, users: int, requests: int, mix: list, seed_value: int, \
+    counter: QueryCounter) -> dict:
+  paths = [path for path, _ in mix]
+  weights = [weight for _, weight in mix]
+  results = {path: {"latencies": [], "errors": 0} for path in paths}
+  lock = threading.Lock()
+  run_id = f'{int(time.time()) % 100000:05d}'
+
+  virtual_users = [VirtualUser(base, f'lt{run_id}{i:04d}', \
+      random.Random(seed_value * 100003 + i)) for i in range(users)]
+  login_started = time.perf_counter()
+  logged_in = sum(user.sign_up() for user in virtual_users)
+  login_seconds = time.perf_counter() - login_started
+  counter.reset()
+
+  def drive(user: VirtualUser) -> None:
+    for _ in range(requests):
+      path = user.rng.choices(paths, weights)[0]
+      started = time.perf_counter()
+      try:
+        status, _ = user.fetch(path)
+      except OSError:
+        status = None
+      elapsed = time.perf_counter() - started
+      with lock:
+        results[path]["latencies"].append(elapsed)
+        if status is None or status >= 400:
+          results[path]["errors"] += 1
+
+  threads = [threading.Thread(target = drive, args = (user,)) \
+      for user in virtual_users]
+  started = time.perf_counter()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.perf_counter() - started
+  queries = counter.reset()
+
+  report = {"users": users, "logged_in": logged_in, \
+      "login_seconds": login_seconds, "seconds": elapsed, \
+      "requests_per_sec": users * requests / elapsed, "pages": {}}
+  for path, result in results.items():
+    latencies = result["latencies"]
+    if not latencies:
+      continue
+    report["pages"][path] = {"requests": len(latencies), \
+        "requests_per_sec": len(latencies) / elapsed, \
+        "p50_ms": percentile(latencies, 50) * 1000, \
+        "p95_ms": percentile(latencies, 95) * 1000, \
+        "p99_ms": percentile(latencies, 99) * 1000, \
+        "error_rate": result["errors"] / len(latencies), \
+        "queries_per_request": queries.get(path, 0) / len(latencies)}
+
+  return report
+
+def git_revision() -> str | None:
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], \
+        check = True, capture_output = True, text = True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--users", type = int, default = 16)
+  parser.add_argument("--requests", type = int, default = 50, \
+      help = "requests per virtual user")
+  parser.add_argument("--mix", default = DEFAULT_MIX)
+  parser.add_argument("--db", default = os.path.join(tempfile.gettempdir(), \
+      "data_barn_load.db"))
+  parser.add_argument("--uri", default = None, \
+      help = "database to seed and test against instead of --db")
+  parser.add_argument("--reseed", action = "store_true", \
+      help = "drop and recreate every table, then load the CSV")
+  parser.add_argument("--rows", type = int, default = None, \
+      help = "CSV rows to load when seeding (default all)")
+  parser.add_argument("--seed", type = int, default = 1)
+  parser.add_argument("--json", default = None)
+  args = parser.parse_args()
+
+  from data_barn import create_app, db
+  uri = args.uri or f'sqlite:///{os.path.abspath(args.db)}'
+  fresh = args.reseed or (args.uri is None and not os.path.exists(args.db))
+  app = create_app({"SQLALCHEMY_DATABASE_URI": uri, "DEBUG": False, \
+      "SNAPSHOT_PATH": os.path.join(tempfile.gettempdir(), \
+      "data_barn_load.snap"), \
+      "FEATURES_PATH": os.path.join(tempfile.gettempdir(), \
+      "data_barn_load.npz")})
+  if fresh:
+    print(f'seeding {uri} ...')
+    seed(app, args.rows or 10 ** 9)
+
+  with app.app_context():
+    counter = QueryCounter(db.engines.values())
+  logging.getLogger("werkzeug").setLevel(logging.WARNING)
+  server = make_server("127.0.0.1", 0, app, threaded = True)
+  threading.Thread(target = server.serve_forever, daemon = True).start()
+  base = f'http://127.0.0.1:{server.server_port}'
+
+  mix = []
+  for item in args.mix.split(","):
+    path, _, weight = item.partition("=")
+    mix.append((path, float(weight or 1)))
+  report = run(base, args.users, args.requests, mix, args.seed, counter)
+  server.shutdown()
+  report.update({"revision": git_revision(), \
+      "database": make_url(uri).get_backend_name(), \
+      "requests_per_user": args.requests, "mix": args.mix, \
+      "seed": args.seed})
+
+  print(f'{report["logged_in"]}/{report["users"]} users logged in ' + \
+      f'({report["login_seconds"]:.1f}s), ' + \
+      f'{report["requests_per_sec"]:.1f} requests/s overall')
+  print(f'{"page":24} {"req":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} ' + \
+      f'{"p99 ms":>8} {"errors":>7} {"queries":>8}')
+  for path, page in report["pages"].items():
+    print(f'{path:24} {page["requests"]:6d} {page["requests_per_sec"]:8.1f} ' + \
+        f'{page["p50_ms"]:8.1f} {page["p95_ms"]:8.1f} {page["p99_ms"]:8.1f} ' + \
+        f'{page["error_rate"]:7.1%} {page["queries_per_request"]:8.1f}')
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent = 2)
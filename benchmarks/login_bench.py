@@ -0,0 +1,87 @@
+'''
+Measures log in latency under a burst of concurrent logins, hashing inline
+on each request thread versus on the bounded PasswordHasher pool.  While
+the logins run, a second set of threads issues cheap "page" requests so the
+effect on the rest of the worker's traffic is visible too.
+
+Usage:
+  python -m benchmarks.login_bench [--threads 32] [--logins 256]
+      [--method scrypt:32768:8:1] [--workers 4]
+'''
+import argparse
+import statistics
+import threading
+import time
+from werkzeug.security import check_password_hash, generate_password_hash
+from data_barn.passwords import PasswordHasher
+
+def percentile(samples: list[float], pct: float) -> float:
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run(verify, threads: int, logins: int, pwhash: str) -> dict:
+  login_times = []
+  page_times = []
+  lock = threading.Lock()
+  remaining = [logins]
+  done = threading.Event()
+
+  def login_worker():
+    while True:
+      with lock:
+        if remaining[0] == 0:
+          return
+        remaining[0] -= 1
+      start = time.perf_counter()
+      verify(pwhash, "correct horse battery staple")
+      with lock:
+        login_times.append(time.perf_counter() - start)
+
+  def page_worker():
+    while not done.is_set():
+      start = time.perf_counter()
+      sum(i * i for i in range(2000))
+      with lock:
+        page_times.append(time.perf_counter() - start)
+      time.sleep(0.005)
+
+  pages = [threading.Thread(target = page_worker) for _ in range(4)]
+  workers = [threading.Thread(target = login_worker) for _ in range(threads)]
+  start = time.perf_counter()
+  for t in pages + workers:
+    t.start()
+  for t in workers:
+    t.join()
+  elapsed = time.perf_counter() - start
+  done.set()
+  for t in pages:
+    t.join()
+
+  return {"logins_per_sec": logins / elapsed, \
+      "login_p50_ms": statistics.median(login_times) * 1000, \
+      "login_p99_ms": percentile(login_times, 99) * 1000, \
+      "page_p99_ms": percentile(page_times, 99) * 1000}
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--threads", type = int, default = 32)
+  parser.add_argument("--logins", type = int, default = 256)
+  parser.add_argument("--method", default = "scrypt:32768:8:1")
+  parser.add_argument("--workers", type = int, default = 4)
+  args = parser.parse_args()
+
+  pwhash = generate_password_hash("correct horse battery staple", \
+      method = args.method)
+  hasher = PasswordHasher(workers = args.workers, \
+      queue_size = args.threads, method = args.method, timeout = 600)
+
+  results = {"inline": run(check_password_hash, args.threads, args.logins, \
+      pwhash), \
+      "pooled": run(hasher.verify, args.threads, args.logins, pwhash)}
+  hasher.shutdown()
+
+  print(f'{"mode":8} {"logins/s":>10} {"p50 ms":>10} {"p99 ms":>10} ' + \
+      f'{"page p99 ms":>12}')
+  for mode, r in results.items():
+    print(f'{mode:8} {r["logins_per_sec"]:10.1f} {r["login_p50_ms"]:10.1f} ' + \
+        f'{r["login_p99_ms"]:10.1f} {r["page_p99_ms"]:12.1f}')
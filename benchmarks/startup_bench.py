@@ -0,0 +1,48 @@
+'''
+Measures cold start of a worker: importing data_barn, building the app with
+create_app(), and serving the first request (the log in page).  The app
+is built with in-memory sessions and an in-memory SQLite database, since
+the log in page stores its CSRF token in the session and the default
+session store is the database, so no database server is needed.  Each
+run is a fresh interpreter so nothing is cached between runs.
+
+Usage:
+  python -m benchmarks.startup_bench [--runs 10]
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import data_barn
+imported = time.perf_counter()
+app = data_barn.create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "SESSION_TYPE": "memory"})
+created = time.perf_counter()
+response = app.test_client().get("/auth/login")
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000}))
+"""
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--runs", type = int, default = 10)
+  args = parser.parse_args()
+
+  samples = []
+  for _ in range(args.runs):
+    out = subprocess.run([sys.executable, "-c", PROBE], check = True, \
+        capture_output = True, text = True).stdout
+    samples.append(json.loads(out.splitlines()[-1]))
+
+  print(f'{"phase":18} {"median ms":>10} {"max ms":>10}')
+  for phase in samples[0]:
+    values = [s[phase] for s in samples]
+    print(f'{phase:18} {statistics.median(values):10.1f} {max(values):10.1f}')
@@ -45,6 +45,38 @@ SET default_tablespace = '';
 
 SET default_table_access_method = heap;
 
+--
+-- Name: data_load; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.data_load (
+    id integer NOT NULL,
+    loaded_at timestamp with time zone DEFAULT now() NOT NULL,
+    entries integer NOT NULL
+);
+
+
+ALTER TABLE public.data_load OWNER TO postgres;
+
+--
+-- Name: data_load_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+--
+
+CREATE SEQUENCE public.data_load_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER SEQUENCE public.data_load_id_seq OWNER TO postgres;
+
+ALTER SEQUENCE public.data_load_id_seq OWNED BY public.data_load.id;
+
+ALTER TABLE ONLY public.data_load ALTER COLUMN id SET DEFAULT nextval('public.data_load_id_seq'::regclass);
+
 --
 -- TOC entry 223 (class 1259 OID 16766)
 -- Name: entry; Type: TABLE; Schema: public; Owner: postgres
@@ -73,6 +105,23 @@ CREATE TABLE public.entry (
 
 ALTER TABLE public.entry OWNER TO postgres;
 
+--
+-- Name: figure; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.figure (
+    running_id uuid NOT NULL,
+    par_seconds real,
+    half_mile_par_seconds real,
+    track_variant real,
+    pace_variant real,
+    speed_figure integer,
+    pace_figure integer
+);
+
+
+ALTER TABLE public.figure OWNER TO postgres;
+
 --
 -- TOC entry 216 (class 1259 OID 16516)
 -- Name: horse; Type: TABLE; Schema: public; Owner: postgres
@@ -202,6 +251,27 @@ CREATE TABLE public."user" (
 
 ALTER TABLE public."user" OWNER TO postgres;
 
+--
+-- Name: web_session; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.web_session (
+    id character varying(64) NOT NULL,
+    data text NOT NULL,
+    expires timestamp with time zone NOT NULL
+);
+
+
+ALTER TABLE public.web_session OWNER TO postgres;
+
+--
+-- Name: data_load data_load_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.data_load
+    ADD CONSTRAINT data_load_pkey PRIMARY KEY (id);
+
+
 --
 -- TOC entry 3483 (class 2606 OID 16770)
 -- Name: entry entry_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
@@ -211,6 +281,14 @@ ALTER TABLE ONLY public.entry
     ADD CONSTRAINT entry_pkey PRIMARY KEY (horse_id, running_id);
 
 
+--
+-- Name: figure figure_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.figure
+    ADD CONSTRAINT figure_pkey PRIMARY KEY (running_id);
+
+
 --
 -- TOC entry 3469 (class 2606 OID 16520)
 -- Name: horse horse_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
@@ -292,6 +370,21 @@ ALTER TABLE ONLY public."user"
     ADD CONSTRAINT user_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: web_session web_session_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.web_session
+    ADD CONSTRAINT web_session_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: ix_web_session_expires; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_web_session_expires ON public.web_session USING btree (expires);
+
+
 --
 -- TOC entry 3494 (class 2606 OID 16771)
 -- Name: entry entry_horse_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
@@ -409,6 +502,28 @@ ALTER TABLE ONLY public.running
     ADD CONSTRAINT running_winner_id_fkey FOREIGN KEY (winner_id) REFERENCES public.horse(id);
 
 
+--
+-- Name: ix_figure_pace_figure; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_figure_pace_figure ON public.figure USING btree (pace_figure);
+
+
+--
+-- Name: ix_figure_speed_figure; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_figure_speed_figure ON public.figure USING btree (speed_figure);
+
+
+--
+-- Name: figure figure_running_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.figure
+    ADD CONSTRAINT figure_running_id_fkey FOREIGN KEY (running_id) REFERENCES public.running(id);
+
+
 -- Completed on 2024-01-03 15:35:14 CST
 
 --
@@ -2,44 +2,257 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os
 import uuid
 
-app = Flask(__name__, instance_relative_config=True)
-
-app.config.from_object('config')
-
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = SQLAlchemy()
+migrate = Migrate()
 login_manager = LoginManager()
 login_manager.login_view = "auth.user_login"
-login_manager.init_app(app)
 
 from .models import User
+from .user_cache import UserCache
+from .passwords import PasswordHasher, LoginThrottle
+from .sessions import ServerSessionInterface, MemorySessionStore
+from .sessions import SQLSessionStore
+from .metrics import Metrics
+from .profiling import Profiler
+from .assets import Assets
+from .replicas import ReplicaRouter
+from .analytics import AnalyticsStore
+from .single_flight import SingleFlight
+from .snapshot import AggregateSnapshot
+from .features import FeatureStore
+from .async_db import AsyncDatabase
+from .notifications import ChangeNotifier
 
-@login_manager.user_loader
-def load_user(user_id):
-  try:
-    return User.query.get(uuid.UUID(user_id))
-  except:
-    return None
+user_cache = UserCache()
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
+metrics = Metrics()
+profiler = Profiler()
+assets = Assets()
+replicas = ReplicaRouter(db)
+analytics = AnalyticsStore(db)
+aggregate_flights = SingleFlight()
+aggregate_snapshot = AggregateSnapshot()
+feature_store = FeatureStore()
+async_db = AsyncDatabase()
+changes = ChangeNotifier()
+
+def create_app(config: dict | None = None) -> Flask:
+  '''
+  Application factory.  Nothing connects to the database while the app is
+  built, so a prefork server (eg. gunicorn --preload) can import and create
+  the app once in the master process.  Pooled connections are dropped in
+  each forked child so no two workers ever share a socket, and the pool is
+  sized from the number of workers and threads configured.
+
+  Parameters:
+    config: dict | None
+      Settings applied on top of config.py, eg. for benchmarks.
+
+  Returns: Flask
+  '''
+  app = Flask(__name__, instance_relative_config=True)
+  app.config.from_object('config')
+  if config:
+    app.config.update(config)
+  app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", _pool_options(app.config))
+  if app.config.get("TRUSTED_PROXIES"):
+    # Take the client address from X-Forwarded-For set by that many
+    # proxies, so per-address limits do not see every client as the proxy.
+    proxies = app.config["TRUSTED_PROXIES"]
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for = proxies, \
+        x_proto = proxies)
+
+  replicas.init_app(app)
+  db.init_app(app)
+  migrate.init_app(app, db)
+  login_manager.init_app(app)
+  user_cache.init_app(app)
+  password_hasher.init_app(app)
+  login_throttle.init_app(app)
+  profiler.init_app(app)
+  assets.init_app(app)
+  aggregate_flights.init_app(app)
+  aggregate_snapshot.init_app(app)
+  feature_store.init_app(app)
+  changes.init_app(app)
+
+  if app.config.get("SESSION_TYPE") == "sqlalchemy":
+    session_store = SQLSessionStore(db)
+  else:
+    session_store = MemorySessionStore()
+  app.session_interface = ServerSessionInterface(session_store, \
+      app.config.get("SESSION_SWEEP_INTERVAL", 300), \
+      app.config.get("SESSION_SWEEP_BATCH", 1000))
+
+  from . import user_auth, dashboard, api
+
+  app.register_blueprint(user_auth.bp)
+  app.register_blueprint(dashboard.bp)
+  app.register_blueprint(api.bp)
+  app.add_url_rule("/", endpoint="dashboard")
+
+  with app.app_context():
+    engines = list(db.engines.values())
+  metrics.init_app(app, engines)
+  analytics.init_app(app, metrics.instrument)
+  async_db.init_app(app, metrics.instrument)
+  metrics.add_collector(_user_cache_metrics)
+  metrics.add_collector(_replica_metrics)
+  metrics.add_collector(_single_flight_metrics)
+  metrics.add_collector(_async_db_metrics)
+  metrics.add_collector(_change_metrics)
+  changes.subscribe(["user"], _user_changed)
+  changes.subscribe(ChangeNotifier.DATA_TABLES, _reload_files)
+  os.register_at_fork(after_in_child = lambda: _dispose_engines(engines))
+
+  return app
+
+def _pool_options(config) -> dict:
+  '''
+  Engine pool settings for a deployment of WEB_WORKERS processes with
+  WEB_THREADS request threads each.  Every thread can hold a connection,
+  and the overflow lets all workers together reach DB_MAX_CONNECTIONS but
+  no further.  Each worker's share of the budget first pays for its other
+  connections: the async pool (ASYNC_DB_POOL_SIZE, with ASYNC_DB) and the
+  change listener (1, with CHANGE_NOTIFICATIONS), so
+
+    pool_size + max_overflow = DB_MAX_CONNECTIONS // WEB_WORKERS
+        - ASYNC_DB_POOL_SIZE - 1
 
-from . import models, user_auth
+  If that is fewer than WEB_THREADS, threads wait for a connection rather
+  than going over the budget.  SQLite keeps SQLAlchemy's defaults.
+  '''
+  if config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    return {}
+  workers = max(1, config.get("WEB_WORKERS", 1))
+  threads = max(1, config.get("WEB_THREADS", 1))
+  per_worker = config.get("DB_MAX_CONNECTIONS", 100) // workers
+  if config.get("ASYNC_DB", False):
+    per_worker -= config.get("ASYNC_DB_POOL_SIZE", 10)
+  if config.get("CHANGE_NOTIFICATIONS", True):
+    per_worker -= 1
 
-app.register_blueprint(user_auth.bp)
+  pool_size = max(1, min(threads, per_worker))
 
-from . import dashboard
+  return {"pool_size": pool_size, \
+      "max_overflow": max(0, per_worker - pool_size), \
+      "pool_pre_ping": True}
 
-app.register_blueprint(dashboard.bp)
-app.add_url_rule("/", endpoint="dashboard")
-#from app import models
+def _user_cache_metrics() -> list[str]:
+  stats = user_cache.stats()
+  lines = []
+  for name in ("hits", "misses", "evictions", "invalidations"):
+    lines.append(f'# TYPE data_barn_user_cache_{name}_total counter')
+    lines.append(f'data_barn_user_cache_{name}_total {stats[name]}')
+  lines.append("# TYPE data_barn_user_cache_size gauge")
+  lines.append(f'data_barn_user_cache_size {stats["size"]}')
 
-#with app.app_context():
-#  db.create_all()
+  return lines
+
+def _replica_metrics() -> list[str]:
+  lines = ["# TYPE data_barn_db_route_statements_total counter"]
+  stats = replicas.stats()
+  for key, values in stats.items():
+    lines.append(f'data_barn_db_route_statements_total{{bind="{key}"}} ' + \
+        f'{values["statements"]}')
+  lines.append("# TYPE data_barn_db_route_failures_total counter")
+  for key, values in stats.items():
+    lines.append(f'data_barn_db_route_failures_total{{bind="{key}"}} ' + \
+        f'{values["failures"]}')
+  lines.append("# TYPE data_barn_db_route_up gauge")
+  for key, values in stats.items():
+    lines.append(f'data_barn_db_route_up{{bind="{key}"}} {int(values["up"])}')
+
+  return lines
+
+def _single_flight_metrics() -> list[str]:
+  stats = aggregate_flights.stats()
+  lines = []
+  for name in ("leaders", "followers", "timeouts", "errors"):
+    lines.append(f'# TYPE data_barn_aggregate_flight_{name}_total counter')
+    lines.append(f'data_barn_aggregate_flight_{name}_total {stats[name]}')
+  lines.append("# TYPE data_barn_aggregate_flights_in_flight gauge")
+  lines.append(f'data_barn_aggregate_flights_in_flight {stats["in_flight"]}')
+
+  return lines
+
+def _async_db_metrics() -> list[str]:
+  if not async_db.enabled:
+    return []
+  stats = async_db.stats()
+  lines = ["# TYPE data_barn_async_db_calls_total counter", \
+      f'data_barn_async_db_calls_total {stats["calls"]}']
+  for name in ("in_flight", "max_in_flight"):
+    lines.append(f'# TYPE data_barn_async_db_calls_{name} gauge')
+    lines.append(f'data_barn_async_db_calls_{name} {stats[name]}')
+
+  return lines
+
+def _change_metrics() -> list[str]:
+  if not changes.enabled:
+    return []
+  stats = changes.stats()
+
+  return ["# TYPE data_barn_change_notifications_total counter", \
+      f'data_barn_change_notifications_total {stats["received"]}', \
+      "# TYPE data_barn_change_listener_connected gauge", \
+      f'data_barn_change_listener_connected {stats["connected"]}']
+
+def _user_changed(payload: dict) -> None:
+  if payload.get("ids") is None:
+    user_cache.clear()
+  else:
+    for key in payload["ids"]:
+      user_cache.invalidate(uuid.UUID(key))
+
+def _reload_files(payload: dict) -> None:
+  aggregate_snapshot.load()
+  feature_store.load()
+
+def _dispose_engines(engines) -> None:
+  # close = False leaves the parent's connections open for the parent and
+  # only gives this process a fresh, empty pool.
+  for engine in engines:
+    engine.dispose(close = False)
+
+@login_manager.user_loader
+def load_user(user_id):
+  '''
+  Returns the logged in user, from user_cache when possible.  The cached
+  instance is detached and shared between threads, so each request gets its
+  own copy merged into its session without loading it from the database.
+  '''
+  try:
+    key = uuid.UUID(user_id)
+  except (TypeError, ValueError):
+    return None
 
-#@app.route('/')
-#def hello():
-#  return {"hello": "world"}
+  user = user_cache.get(key)
+  if user is None:
+    user = db.session.get(User, key)
+    if user is None:
+      return None
+    db.session.expunge(user)
+    user_cache.put(key, user)
 
+  return db.session.merge(user, load = False)
 
-if __name__ == "__main__":
-  app.run(debug=True)
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user(mapper, connection, target) -> None:
+  '''
+  Drops a changed user from user_cache in every worker.  The notification
+  is sent on the flush's connection, and this worker's cache is only
+  updated once the session commits, so both happen when the change commits
+  (eg. a registration in user_auth) and neither if it rolls back.
+  '''
+  changes.publish(["user"], ids = [target.id.hex], connection = connection, \
+      session = object_session(target))
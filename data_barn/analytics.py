@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+import numpy as np
+from sqlalchemy import Column, Double, Float, MetaData, Table, create_engine
+from sqlalchemy import exc, select
+from sqlalchemy.schema import CreateTable
+from .models import Entry, Running, Race, Horse, Jockey, Trainer, Track
+from .models import Figure, DataLoad
+
+try:
+  import duckdb
+except ImportError:
+  duckdb = None
+
+log = logging.getLogger("data_barn.analytics")
+
+class AnalyticsStore(object):
+  '''
+  Optional columnar copy of the racing tables in an embedded DuckDB file,
+  used by DBHandler for its scan-and-group reads.  export() copies entry,
+  running, race, the party tables, track, figure, and data_load (so the
+  copy reports the data version it was exported at) from the primary into
+  a new file (same table and column names, no keys or indexes) and swaps
+  it in, so DBHandler's statements run unchanged on either database.
+  Users, sessions, and all writes stay in PostgreSQL.
+
+  Enabled by setting ANALYTICS_URI (eg., "duckdb:///analytics.duckdb")
+  with the duckdb and duckdb-engine packages installed.  Until the first
+  export, or if a statement fails on DuckDB, reads fall back to the
+  primary or replicas.  Workers open the file read-only and reconnect when
+  an export replaces it.
+
+  Attributes:
+    TABLES: list
+      Models copied by export().
+
+    CHUNK: int
+      Rows copied per insert during export.
+
+    uri: str | None
+      SQLAlchemy URI of the DuckDB file.
+
+    path: str | None
+      File path taken from uri.
+
+  Methods:
+    init_app(app, on_engine):
+      Reads ANALYTICS_URI and adds the "flask export-analytics" command.
+      on_engine(engine) is called for each engine opened, eg. to add
+      metrics listeners.
+
+    enabled():
+      Whether an export exists to read from.
+
+    execute(stmt):
+      Runs a select on the DuckDB copy and returns all rows, or None if
+      it is not available.
+
+    export():
+      Rebuilds the DuckDB copy from the primary database.
+
+    _column_type(column):
+      DuckDB type matching a model column's PostgreSQL type.
+
+    _engine():
+      Read-only engine for this process, reopened after an export.
+  '''
+  TABLES = [Entry, Running, Race, Horse, Jockey, Trainer, Track, Figure, \
+      DataLoad]
+  CHUNK = 10000
+
+  def __init__(self, db) -> None:
+    self.db = db
+    self.uri = None
+    self.path = None
+    self._on_engine = None
+    self._engine_state = None
+    self._lock = threading.Lock()
+
+  def init_app(self, app, on_engine = None) -> None:
+    self.uri = app.config.get("ANALYTICS_URI")
+    self.path = None
+    self._on_engine = on_engine
+    self._engine_state = None
+    if self.uri and duckdb is None:
+      log.warning("ANALYTICS_URI is set but duckdb is not installed")
+      self.uri = None
+    if self.uri:
+      self.path = self.uri.split(":///", 1)[1].split("?", 1)[0]
+
+    @app.cli.command("export-analytics")
+    def export_analytics_command():
+      '''Copy the racing tables into the DuckDB analytics file.'''
+      if self.uri is None:
+        print("ANALYTICS_URI is not configured")
+        return
+      print(f'Exported {self.export()} rows to {self.path}')
+
+  def enabled(self) -> bool:
+    return self.path is not None and os.path.exists(self.path)
+
+  def execute(self, stmt) -> list | None:
+    if not self.enabled():
+      return None
+    try:
+      with self._engine().connect() as conn:
+        return conn.execute(stmt).fetchall()
+    except exc.SQLAlchemyError as e:
+      log.warning("analytics query failed, using the primary: %s", e)
+      return None
+
+  def export(self) -> int:
+    '''
+    Copies the racing tables from the primary into a new DuckDB file and
+    replaces the current one with it.  Runs after each DataLoader load.
+
+    Returns: int
+      Rows copied.
+    '''
+    dialect = create_engine(self.uri).dialect
+    tmp = self.path + ".tmp"
+    if os.path.exists(tmp):
+      os.remove(tmp)
+
+    copied = 0
+    duck = duckdb.connect(tmp)
+    try:
+      with self.db.engine.connect() as source:
+        for model in self.TABLES:
+          table = Table(model.__tablename__, MetaData(), \
+              *[Column(c.name, self._column_type(c)) \
+              for c in model.__table__.columns])
+          duck.execute(str(CreateTable(table).compile(dialect = dialect)))
+          names = ", ".join(f'"{c.name}"' for c in table.columns)
+          result = source.execution_options(stream_results = True) \
+              .execute(select(*model.__table__.columns))
+          for rows in result.partitions(self.CHUNK):
+            columns = list(zip(*rows))
+            duck.register("chunk", {c.name: np.array(values, dtype = object) \
+                for c, values in zip(table.columns, columns)})
+            duck.execute(f'INSERT INTO "{table.name}" ({names}) ' + \
+                f'SELECT {names} FROM chunk')
+            duck.unregister("chunk")
+            copied += len(rows)
+      duck.execute("CHECKPOINT")
+    finally:
+      duck.close()
+    os.replace(tmp, self.path)
+
+    return copied
+
+  def _column_type(self, column):
+    # DuckDB reads FLOAT(p) as a 4-byte REAL; DOUBLE keeps the values the
+    # driver hands over from PostgreSQL exactly as DBHandler would see them.
+    if isinstance(column.type, Float) and not isinstance(column.type, Double):
+      return Double()
+
+    return column.type
+
+  def _engine(self):
+    stat = os.stat(self.path)
+    state = (os.getpid(), stat.st_ino, stat.st_mtime_ns)
+    with self._lock:
+      if self._engine_state is None or self._engine_state[0] != state:
+        if self._engine_state is not None and \
+            self._engine_state[0][0] == state[0]:
+          self._engine_state[1].dispose()
+        engine = create_engine(self.uri, \
+            connect_args = {"read_only": True})
+        if self._on_engine is not None:
+          self._on_engine(engine)
+        self._engine_state = (state, engine)
+
+      return self._engine_state[1]
@@ -0,0 +1,32 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+from . import feature_store
+
+bp = Blueprint("api", __name__, url_prefix = "/api")
+
+@bp.route("/score", methods = ("POST",))
+@login_required
+def score():
+  '''
+  Scores a card of upcoming entries against the handicapping features.
+  Takes a JSON body {"entries": [...]} where each entry may have "race",
+  "horse", "jockey", "trainer", "sire", "surface", "distance", "post", and
+  "odds", and returns the entries with a score and a win probability within
+  their race.  View requires authenticated user.
+  '''
+  body = request.get_json(silent = True)
+  entries = body.get("entries") if isinstance(body, dict) else None
+  if not isinstance(entries, list) or \
+      not all(isinstance(entry, dict) for entry in entries):
+    return jsonify(error = 'Expected a JSON object with a list of "entries".'), \
+        400
+  if not feature_store.load():
+    return jsonify(error = "Handicapping features have not been built."), \
+        503, {"Retry-After": "60"}
+
+  try:
+    scores = feature_store.score(entries)
+  except (TypeError, ValueError) as e:
+    return jsonify(error = f'Invalid entry: {e}'), 400
+
+  return jsonify(entries = scores)
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import click
+from flask import abort, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+COMPRESSIBLE = (".css", ".js", ".json", ".svg", ".txt", ".html", ".map")
+
+def build_assets(static_dir: str, out_dir: str) -> dict[str, str]:
+  '''
+  Copies every file in static_dir to out_dir under a name containing a hash
+  of its contents, eg. bootstrap.min.css -> bootstrap.min.0f3c9a1e2b.css,
+  and writes gzip (and brotli, if the brotli package is installed) variants
+  of text assets next to them when compression saves space.  Files from
+  previous builds are removed.  The mapping of original to fingerprinted
+  names is written to manifest.json in out_dir, and an existing out_dir is
+  only removed if it has one, so a mistyped path cannot delete anything
+  but an earlier build.
+
+  Parameters:
+    static_dir: str
+      Source folder, usually the app's static folder.
+
+    out_dir: str
+      Build folder, eg. static/dist.  Not itself copied when it is inside
+      static_dir.
+
+  Returns: dict[str, str]
+    The manifest.
+
+  Raises: ValueError
+    If out_dir is static_dir or contains it, or is a folder that is not
+    empty and was not made by build_assets.
+  '''
+  out = os.path.realpath(out_dir)
+  if os.path.commonpath([out, os.path.realpath(static_dir)]) == out:
+    raise ValueError(f'{out_dir} holds the static files it would be ' + \
+        'built from')
+  if os.path.isdir(out_dir) and os.listdir(out_dir):
+    if not os.path.isfile(os.path.join(out_dir, "manifest.json")):
+      raise ValueError(f'{out_dir} is not empty and has no manifest.json ' + \
+          'from an earlier build')
+    shutil.rmtree(out_dir)
+  os.makedirs(out_dir, exist_ok = True)
+
+  manifest = {}
+  for root, dirs, files in os.walk(static_dir):
+    dirs[:] = sorted(d for d in dirs \
+        if os.path.abspath(os.path.join(root, d)) != os.path.abspath(out_dir))
+    for filename in sorted(files):
+      source = os.path.join(root, filename)
+      name = os.path.relpath(source, static_dir).replace(os.sep, "/")
+      with open(source, "rb") as f:
+        content = f.read()
+      stem, ext = os.path.splitext(name)
+      hashed = f'{stem}.{hashlib.sha256(content).hexdigest()[:10]}{ext}'
+      target = os.path.join(out_dir, hashed)
+      os.makedirs(os.path.dirname(target), exist_ok = True)
+      with open(target, "wb") as f:
+        f.write(content)
+
+      if ext in COMPRESSIBLE:
+        variants = [(".gz", gzip.compress(content, 9, mtime = 0))]
+        if brotli is not None:
+          variants.append((".br", brotli.compress(content, quality = 11)))
+        for suffix, packed in variants:
+          if len(packed) < len(content):
+            with open(target + suffix, "wb") as f:
+              f.write(packed)
+      manifest[name] = hashed
+
+  with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+    json.dump(manifest, f, indent = 2, sort_keys = True)
+
+  return manifest
+
+
+class Assets(object):
+  '''
+  Serves the output of build_assets on /assets with far-future immutable
+  caching, picking the brotli or gzip variant the browser accepts.  Templates
+  call asset_url(filename) in place of url_for('static', filename = ...);
+  it resolves to the fingerprinted file when a build exists and falls back
+  to the plain static file otherwise, so development needs no build step.
+  The build is run with "flask build-assets" and should be rerun whenever
+  a static file changes.
+
+  Attributes:
+    directory: str
+      Build folder, ASSETS_DIR or static/dist.
+
+    max_age: int
+      Cache lifetime in seconds for fingerprinted files, ASSETS_MAX_AGE.
+
+    manifest: dict[str, str]
+      Original file name to fingerprinted name.
+
+  Methods:
+    init_app(app):
+      Loads the manifest and adds the route, template global, and command.
+
+    url(filename):
+      URL for a static file, fingerprinted when possible.
+
+    load_manifest():
+      Reads manifest.json from the build folder, if any.
+
+    _serve(filename):
+      View for /assets/<filename>.
+  '''
+  def __init__(self) -> None:
+    self.directory = ""
+    self.max_age = 31536000
+    self.manifest = {}
+
+  def init_app(self, app) -> None:
+    self.directory = app.config.get("ASSETS_DIR") or \
+        os.path.join(app.static_folder, "dist")
+    self.max_age = app.config.get("ASSETS_MAX_AGE", self.max_age)
+    self.load_manifest()
+    app.add_url_rule("/assets/<path:filename>", "assets", self._serve)
+    app.add_template_global(self.url, "asset_url")
+
+    @app.cli.command("build-assets")
+    def build_assets_command():
+      '''Fingerprint and precompress static files.'''
+      try:
+        manifest = build_assets(app.static_folder, self.directory)
+      except ValueError as e:
+        raise click.ClickException(str(e))
+      self.manifest = manifest
+      print(f'Built {len(manifest)} assets in {self.directory}')
+
+  def url(self, filename: str) -> str:
+    hashed = self.manifest.get(filename)
+    if hashed is None:
+      return url_for("static", filename = filename)
+
+    return url_for("assets", filename = hashed)
+
+  def load_manifest(self) -> None:
+    path = os.path.join(self.directory, "manifest.json")
+    try:
+      with open(path) as f:
+        self.manifest = json.load(f)
+    except FileNotFoundError:
+      self.manifest = {}
+
+  def _serve(self, filename: str):
+    if filename.endswith((".gz", ".br")) or filename == "manifest.json":
+      abort(404)
+    path = safe_join(self.directory, filename)
+    if path is None:
+      abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    encoding = None
+    for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+      if request.accept_encodings[name] and \
+          os.path.isfile(path + suffix):
+        encoding = name
+        filename += suffix
+        break
+
+    response = send_from_directory(self.directory, filename, \
+        mimetype = mimetype, max_age = self.max_age)
+    if encoding is not None:
+      response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
@@ -0,0 +1,166 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+class AsyncDatabase(object):
+  '''
+  Optional asyncio database engine for dashboard reads, used by
+  AsyncDBHandler.  Each worker process runs one event loop in a background
+  thread that owns an async engine (psycopg's async driver for PostgreSQL)
+  and its pool.  Request threads hand coroutines to the loop with call()
+  and wait for the result, so every thread's queries share the loop and
+  many of them, including the independent queries within one page, are in
+  flight at once over the pool's connections.
+
+  Flask under WSGI would run an async def view on a new event loop for
+  each request, and pooled async connections cannot move between loops, so
+  views stay synchronous and run AsyncDBHandler coroutines here instead.
+  The loop, thread, and engine are created on first use in each process,
+  after any fork.
+
+  Enabled by setting ASYNC_DB.  ASYNC_DATABASE_URI defaults to
+  SQLALCHEMY_DATABASE_URI with its async driver (postgresql+psycopg, or
+  sqlite+aiosqlite when aiosqlite is installed).
+
+  Attributes:
+    enabled: bool
+      ASYNC_DB.
+
+    uri: str | None
+      Async SQLAlchemy URI.
+
+    pool_size: int
+      Connections in each worker's async pool (ASYNC_DB_POOL_SIZE); more
+      concurrent queries wait for a connection.
+
+    timeout: float
+      Seconds call() waits before cancelling the coroutine and raising
+      TimeoutError (ASYNC_DB_TIMEOUT).
+
+  Methods:
+    init_app(app, on_engine):
+      Reads the config.  on_engine(engine) is called with the sync facade
+      of each async engine created, eg. to add metrics listeners.
+
+    call(func, *args, **kwargs):
+      Runs the coroutine func(*args, **kwargs) on the event loop with the
+      caller's context (request, metrics) and returns its result.
+
+    execute(stmt):
+      Coroutine running a select on the async engine and returning all
+      rows.
+
+    stats():
+      Calls made, calls in flight, and the most in flight at once.
+
+    _start():
+      Starts the event loop and engine in the current process.
+  '''
+  DRIVERS = {"postgresql": "postgresql+psycopg", "sqlite": "sqlite+aiosqlite"}
+
+  def __init__(self) -> None:
+    self.enabled = False
+    self.uri = None
+    self.pool_size = 10
+    self.timeout = 30.0
+    self.calls = 0
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self._on_engine = None
+    self._loop = None
+    self._engine = None
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def init_app(self, app, on_engine = None) -> None:
+    self.enabled = app.config.get("ASYNC_DB", False)
+    self.pool_size = app.config.get("ASYNC_DB_POOL_SIZE", self.pool_size)
+    self.timeout = app.config.get("ASYNC_DB_TIMEOUT", self.timeout)
+    self.uri = app.config.get("ASYNC_DATABASE_URI")
+    if self.uri is None:
+      url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+      self.uri = url.set(drivername = self.DRIVERS.get( \
+          url.get_backend_name(), url.drivername)) \
+          .render_as_string(hide_password = False)
+    self._on_engine = on_engine
+
+  def call(self, func, *args, **kwargs):
+    loop = self._start()
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+    tasks = []
+
+    def finish(task) -> None:
+      if task.cancelled():
+        future.cancel()
+      elif task.exception() is not None:
+        future.set_exception(task.exception())
+      else:
+        future.set_result(task.result())
+
+    def begin() -> None:
+      # Tasks copy the current context, so the coroutine sees the
+      # caller's request and metrics context variables.
+      coro = None
+      try:
+        coro = func(*args, **kwargs)
+        task = context.run(loop.create_task, coro)
+      except Exception as e:
+        # Fail the call now rather than leave the caller waiting until
+        # the timeout.
+        if coro is not None and hasattr(coro, "close"):
+          coro.close()
+        future.set_exception(e)
+        return
+      task.add_done_callback(finish)
+      tasks.append(task)
+
+    def cancel() -> None:
+      for task in tasks:
+        task.cancel()
+
+    with self._lock:
+      self.calls += 1
+      self.in_flight += 1
+      self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      loop.call_soon_threadsafe(begin)
+      return future.result(self.timeout)
+    except concurrent.futures.TimeoutError:
+      loop.call_soon_threadsafe(cancel)
+      raise TimeoutError(f'database call gave up after {self.timeout}s')
+    finally:
+      with self._lock:
+        self.in_flight -= 1
+
+  async def execute(self, stmt) -> list:
+    async with self._engine.connect() as conn:
+      result = await conn.execute(stmt)
+
+      return result.fetchall()
+
+  def stats(self) -> dict[str, int]:
+    with self._lock:
+      return {"calls": self.calls, "in_flight": self.in_flight, \
+          "max_in_flight": self.max_in_flight}
+
+  def _start(self) -> asyncio.AbstractEventLoop:
+    with self._lock:
+      if self._pid != os.getpid():
+        options = {}
+        if make_url(self.uri).get_backend_name() != "sqlite":
+          options = {"pool_size": self.pool_size, "max_overflow": 0, \
+              "pool_pre_ping": True}
+        self._engine = create_async_engine(self.uri, **options)
+        if self._on_engine is not None:
+          self._on_engine(self._engine.sync_engine)
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target = self._loop.run_forever, \
+            name = "data_barn-async-db", daemon = True).start()
+        self._pid = os.getpid()
+
+      return self._loop
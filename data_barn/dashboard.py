@@ -1,13 +1,54 @@
 from flask import Blueprint, request, render_template, flash, url_for, redirect, session
+from flask import abort
 from sqlalchemy import select, exc, func
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import login_required, current_user
-from . import db
+import uuid
+from . import db, aggregate_flights, async_db, changes
 from .models import Entry, Horse, Jockey, Trainer
-from .db_handler import DBHandler
+from .db_handler import DBHandler, AsyncDBHandler
+from .single_flight import FlightTimeout
 
 bp = Blueprint("dashboard", __name__, url_prefix = "/")
 dbh = DBHandler()
+adbh = AsyncDBHandler()
+
+def data_changed(payload: dict) -> None:
+  '''
+  Subscribed to change notifications for the racing tables.  Takes the new
+  data version from the notification, so aggregate keys and statistics
+  move to the new data right away instead of within DATA_VERSION_TTL.
+  '''
+  dbh.refresh_statistics(payload.get("version"))
+  adbh.refresh_statistics(payload.get("version"))
+
+changes.subscribe(changes.DATA_TABLES, data_changed)
+
+def query(method: str, *args):
+  '''
+  Runs a DBHandler method, or with ASYNC_DB set runs the AsyncDBHandler
+  coroutine of the same name on the async_db event loop.
+  '''
+  if async_db.enabled:
+    return async_db.call(getattr(adbh, method), *args)
+
+  return getattr(dbh, method)(*args)
+
+def coalesced(name: str, method: str, *args):
+  '''
+  Runs a DBHandler aggregate through aggregate_flights, so concurrent
+  requests for the same aggregate over the same data share one set of
+  queries.
+  '''
+  key = (name,) + args + (query("data_version"),)
+
+  return aggregate_flights.do(key, query, method, *args)
+
+@bp.errorhandler(FlightTimeout)
+@bp.errorhandler(TimeoutError)
+def aggregate_timeout(error):
+  return "The server is busy.  Please try again in a moment.", 503, \
+      {"Retry-After": "5"}
 
 @bp.route("/", methods = ("GET", "POST"))
 @login_required
@@ -27,15 +68,68 @@ def aggregator(measure = None) -> str:
   '''
   if request.method == "GET":
     if measure == "sires":
-      sires = dbh.all_aggregate_wins(Horse)
+      sires = coalesced("aggregates", "all_aggregate_wins", Horse)
       return render_template("main/sires.html", sires = sires, measure = "sires")
     if measure == "jockeys":
-      jockeys = dbh.all_aggregate_wins(Jockey)
+      jockeys = coalesced("aggregates", "all_aggregate_wins", Jockey)
       return render_template("main/jockeys.html", jockeys = jockeys, measure = "jockeys")
     if measure == "trainers":
-      trainers = dbh.all_aggregate_wins(Trainer)
+      trainers = coalesced("aggregates", "all_aggregate_wins", Trainer)
       return render_template("main/trainers.html", trainers = trainers, measure = "trainers")
 
   return render_template("main/index.html")
 
+@bp.route("/statistics/<measure>", methods = ("GET",))
+@login_required
+def statistics(measure = None) -> str:
+  '''
+  Shows win share and average winning odds leaderboards for sires,
+  jockeys, or trainers, broken down by surface, distance, and odds band.
+  View requires authenticated user.
+  '''
+  parties = {"sires": Horse, "jockeys": Jockey, "trainers": Trainer}
+  if measure not in parties:
+    abort(404)
+
+  stats = coalesced("statistics", "party_statistics", parties[measure])
+  return render_template("main/statistics.html", stats = stats, \
+      measure = measure)
+
+@bp.route("/figures/<figure>", methods = ("GET",))
+@login_required
+def figures(figure = None) -> str:
+  '''
+  Shows the best winning speed or pace figures.  View requires authenticated
+  user.
+  '''
+  if figure not in ("speed", "pace"):
+    abort(404)
+
+  leaders = coalesced("figures", "figure_leaders", figure)
+  return render_template("main/figures.html", leaders = leaders, \
+      figure = figure)
+
+@bp.route("/history/<measure>/<party_id>", methods = ("GET",))
+@login_required
+def history(measure = None, party_id = None) -> str:
+  '''
+  Shows past performances for a single horse, sire (starts by offspring),
+  jockey, or trainer.  View requires authenticated user.
+  '''
+  parties = {"horses": Horse, "sires": Horse, "jockeys": Jockey, \
+      "trainers": Trainer}
+  if measure not in parties:
+    abort(404)
+  try:
+    party_id = uuid.UUID(party_id)
+  except ValueError:
+    abort(404)
+
+  party = db.session.get(parties[measure], party_id)
+  if party is None:
+    abort(404)
+  starts = query("past_performances", parties[measure], party_id, \
+      measure == "sires")
 
+  return render_template("main/history.html", party = party, \
+      starts = starts, measure = measure)
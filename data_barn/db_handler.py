@@ -1,7 +1,13 @@
+import asyncio
+import time
+from flask import current_app
 from sqlalchemy import select, exc, func
 #from sqlalchemy.sql import in_
-from .models import Jockey, Entry, Horse, Trainer, Running, Race
-from . import db, app
+from .models import Jockey, Entry, Horse, Trainer, Running, Race, Track
+from .models import Figure, DataLoad
+from .stats_engine import StatsEngine
+from .metrics import track_method
+from . import db, replicas, analytics, aggregate_snapshot, async_db, changes
 
 class DBHandler(object):
   '''
@@ -11,12 +17,34 @@ class DBHandler(object):
     _total_indexed: int
       Total number of races in database.
 
+    _stats_engine: StatsEngine
+      Win share and winning odds engine built over every winning entry,
+      loaded on first use.
+
+    _version: int | None
+      Data version last read from data_load.
+
+    _version_checked: float | None
+      time.monotonic() when _version was last read.
+
   Methods:
     __init__(): 
-      Stores total number of races in database as member variable.
+      Sets up member variables.  No queries are run until first use, so
+      a handler can be created at import time.
 
     total_indexed():
-      Getter for number of races.
+      Getter for number of races, taken from the aggregate snapshot when
+      it matches the data version, else counted on first access after each
+      change of data version.
+
+    data_version():
+      Identifies the data the handler is reading, for cache and
+      coalescing keys: the id of the latest DataLoader load.  While the
+      change listener is connected, loads arrive as notifications and it
+      is only read again every DATA_VERSION_LISTEN_TTL seconds, in case
+      one was lost; otherwise it is read at most every DATA_VERSION_TTL
+      seconds.  When it moves on the race count and StatsEngine are
+      dropped to be rebuilt.
 
     wins_all_time(party):
       Finds total number of wins in database for each sire, jockey, or trainer.
@@ -33,75 +61,316 @@ class DBHandler(object):
       Finds total wins for each sire, jockey, or trainer for route and sprint
       races.
 
-    all_aggregate_wins(party):
-      Combines wins_all_time and wins_by_*.
+    all_aggregate_wins(party, live):
+      Combines wins_all_time and wins_by_*.  Served from the aggregate
+      snapshot when it matches the current data, unless live is True.
+
+    party_statistics(party):
+      Wins, share of wins, and average winning odds for each sire, jockey,
+      or trainer by surface, distance class, and odds band.
+
+    refresh_statistics(version):
+      Takes the data version published with a change notification, so
+      the StatsEngine is rebuilt without waiting for DATA_VERSION_TTL, or
+      with no version reads it again on next use.
+
+    figure_leaders(figure, limit):
+      Top winners by speed or pace figure.
+
+    past_performances(party, party_id, sires):
+      Finds every start for a horse, jockey, or trainer (or the offspring
+      of a sire) along with its race and connections in a single query.
+
+    _execute(stmt):
+      Runs a read on the DuckDB analytics copy when one is configured and
+      exported, and otherwise through the replica router, which uses a
+      read replica when one is healthy and the primary otherwise.
 
     _get_aggregate_winners_where_tie(results_list):
       Takes dictionaries from wins_* functions and extracts top three winning
-      numbers with any number of associated trainers, jockeys, or sires.
+      numbers (or as many as there are) with any number of associated
+      trainers, jockeys, or sires.
 
     _get_total_races_indexed():
       Finds total number of races currently recorded in database.
+
+    _get_data_version():
+      Reads the latest data_load id, or 0 before the first load.
+
+    _get_stats_engine():
+      Loads every winning entry in one query and builds a StatsEngine over
+      it.
+
+    _version_due():
+      Whether the data version should be read again.
+
+    _set_version(version):
+      Records the data version, dropping what was built from older data.
+
+    _*_stmt(...), _*_stmts(party):
+      Build the statements the methods above run, without running them, so
+      AsyncDBHandler runs exactly the same queries.
   '''
   def __init__(self):
-    with app.app_context():
-
-      self._total_indexed = self._get_total_races_indexed()
+    self._total_indexed = None
+    self._stats_engine = None
+    self._version = None
+    self._version_checked = None
 
   @property
   def total_indexed(self) -> int:
+    version = self.data_version()
+    if self._total_indexed is None:
+      total = aggregate_snapshot.total(version)
+      self._total_indexed = total if total is not None else \
+          self._get_total_races_indexed()
+
     return self._total_indexed
 
+  def data_version(self) -> int:
+    if self._version_due():
+      self._set_version(self._get_data_version())
+
+    return self._version
+
+  @track_method
   def wins_all_time(self, party) -> dict[dict[int, list]]:
+    result = self._execute(self._wins_all_time_stmt(party))
+    top_three_with_ties = self._get_aggregate_winners_where_tie(result)
+
+    return top_three_with_ties
+
+  @track_method
+  def wins_by_surface_type(self, party) -> dict[dict[int, list]]:
+    surf_wins = {}
+    for surface, stmt in self._wins_by_surface_stmts(party).items():
+      result = self._execute(stmt)
+      surf_wins[surface] = self._get_aggregate_winners_where_tie(result)
+
+    return surf_wins
+
+  @track_method
+  def wins_by_race_type(self, party) -> dict[dict[int, list]]:
+    wins_by_type = {}
+    for race_type, stmt in self._wins_by_race_type_stmts(party).items():
+      result = self._execute(stmt)
+      wins_by_type[race_type] = self._get_aggregate_winners_where_tie(result)
+
+    return wins_by_type
+
+
+  @track_method
+  def wins_by_distance(self, party) -> dict[dict[int, list]]:
+    wins_by_dist_class = {}
+    for cut, stmt in self._wins_by_distance_stmts(party).items():
+      result = self._execute(stmt)
+      wins_by_dist_class[cut] = self._get_aggregate_winners_where_tie(result)
+
+    return wins_by_dist_class
+
+  @track_method
+  def all_aggregate_wins(self, party, live: bool = False) -> dict:
+    if not live:
+      measures = {Horse: "sires", Jockey: "jockeys", Trainer: "trainers"}
+      snapshot = aggregate_snapshot.aggregates(measures[party], \
+          self.data_version())
+      if snapshot is not None:
+        return snapshot
+
+    wins_by_stat_type = {}
+
+    wins_by_stat_type["all_time"] = self.wins_all_time(party)
+    wins_by_stat_type["surface"] = self.wins_by_surface_type(party)
+    wins_by_stat_type["race_type"] = self.wins_by_race_type(party)
+    wins_by_stat_type["distance"] = self.wins_by_distance(party)
+
+    return wins_by_stat_type
+
+  @track_method
+  def party_statistics(self, party, min_wins: int = 3) -> dict:
+    '''
+    Win share and winning odds leaderboards for sires (Horse), jockeys, or
+    trainers.  The statistics are computed by StatsEngine over every
+    winning entry; only the names of the parties that make a leaderboard
+    are looked up here.
+
+    Parameters:
+      party: Horse, Jockey, or Trainer
+      min_wins: int
+        Minimum wins in a group to appear in that group's leaderboard.
+
+    Returns: dict
+      Breakdown name -> group label -> list of row dicts with id, name
+      fields, wins, share, and avg_odds.
+    '''
+    measures = {Horse: "sires", Jockey: "jockeys", Trainer: "trainers"}
+    stats = self._get_stats_engine().all_rates(measures[party], min_wins)
+    names = self._execute(self._party_names_stmt(party, stats))
+
+    return self._add_party_names(stats, names)
+
+  def refresh_statistics(self, version: int | None = None) -> None:
+    if version is None:
+      self._version_checked = None
+    else:
+      self._set_version(version)
+
+  @track_method
+  def figure_leaders(self, figure: str = "speed", limit: int = 25) -> list:
+    '''
+    Finds the best winning performances by speed or pace figure.  Figures
+    are precomputed by FigureBuilder and indexed, so this is an index scan
+    on the figure table joined to the top rows only.
+
+    Parameters:
+      figure: str
+        "speed" or "pace"
+      limit: int
+        Number of performances returned.
+
+    Returns: list
+      Rows with the winner, race, and both figures, best first.
+    '''
+    return self._execute(self._figure_leaders_stmt(figure, limit))
+
+  @track_method
+  def past_performances(self, party, party_id, sires = False) -> list:
+    '''
+    Builds past performance lines for one horse, jockey, or trainer.  The 
+    race, running, and connections for each start are pulled in with one
+    hand-written join rather than through the lazy relationships on Entry,
+    so the number of queries per page does not grow with the length of the
+    history.
+
+    Parameters:
+      party: Horse, Jockey, or Trainer
+        Model whose history is requested.
+      party_id: uuid.UUID
+        PK of the horse, jockey, or trainer.
+      sires: bool
+        If True (and party is Horse), returns the starts of every horse
+        sired by party_id instead of the horse's own starts.
+
+    Returns: list
+      One row per start, most recent first.
+    '''
+    return self._execute(self._past_performances_stmt(party, party_id, \
+        sires))
+
+  def _execute(self, stmt) -> list:
+    rows = analytics.execute(stmt)
+    if rows is None:
+      rows = replicas.execute(stmt)
+
+    return rows
+
+  def _get_aggregate_winners_where_tie(self, results_lst):
+    wins_with_ties = {}
+    temp_results = results_lst[:]
+    while len(wins_with_ties) < 3 and temp_results:
+      top = temp_results[0].wins
+      cutoff = sum(1 for sire in temp_results if sire.wins == top)
+      wins_with_ties[top] = temp_results[:cutoff]
+      temp_results = temp_results[cutoff:]
+
+    return wins_with_ties
+
+
+  @track_method
+  def _get_total_races_indexed(self) -> int:
+    result = self._execute(self._total_races_stmt())
+
+    return result[0][0]
+
+  def _get_data_version(self) -> int:
+    result = self._execute(self._data_version_stmt())
+
+    return result[0][0] or 0
+
+  @track_method
+  def _get_stats_engine(self) -> StatsEngine:
+    version = self.data_version()
+    engine = self._stats_engine
+    if engine is None:
+      engine = StatsEngine(self._execute(self._entries_stmt()))
+      # Not kept if a newer version arrived while it was being built.
+      if self._version == version:
+        self._stats_engine = engine
+
+    return engine
+
+  def _version_due(self) -> bool:
+    if self._version is None or self._version_checked is None:
+      return True
+    if changes.connected:
+      ttl = current_app.config.get("DATA_VERSION_LISTEN_TTL", 300)
+    else:
+      ttl = current_app.config.get("DATA_VERSION_TTL", 5)
+
+    return time.monotonic() - self._version_checked >= ttl
+
+  def _set_version(self, version: int) -> None:
+    if version != self._version:
+      self._stats_engine = None
+      self._total_indexed = None
+    self._version = version
+    self._version_checked = time.monotonic()
+
+  def _add_party_names(self, stats: dict, names: list) -> dict:
+    names = {row.id: row._asdict() for row in names}
+    for groups in stats.values():
+      for rows in groups.values():
+        for row in rows:
+          row.update(names.get(row["id"], {}))
+
+    return stats
+
+  def _wins_all_time_stmt(self, party):
     if party == Horse: # Horse stands in for "sires" measures
       stmt = db.select(party.sire_id, func.count(party.sire_id) \
           .label("wins")).join(Entry).group_by(party.sire_id)
       subq = (stmt.cte())
-      full_join = db.select(party.name, subq.c.wins).select_from(party) \
+      full_join = db.select(party.id, party.name, subq.c.wins) \
+          .select_from(party) \
           .join(subq, party.id == subq.c.sire_id).order_by(subq.c.wins.desc())
     else:
       stmt = db.select(party.id, func.count(party.id).label("wins")) \
           .join(Entry).group_by(party.id)
       subq = (stmt.cte())
-      full_join = db.select(party.first_name, party.last_name, subq.c.wins) \
+      full_join = db.select(party.id, party.first_name, party.last_name, \
+          subq.c.wins) \
           .select_from(party).join(subq, party.id == subq.c.id) \
           .order_by(subq.c.wins.desc())
 
-    result = db.session.execute(full_join).fetchall()
-    top_three_with_ties = self._get_aggregate_winners_where_tie(result)
-
-    return top_three_with_ties
+    return full_join
 
-  def wins_by_surface_type(self, party) -> dict[dict[int, list]]:
+  def _wins_by_surface_stmts(self, party) -> dict:
     avail_surfaces = ["Turf", "Polytrack"]
-    surf_wins = {}
-    
+    stmts = {}
+
     for surface in avail_surfaces:
       if party == Horse:
         sires = db.select(party.sire_id, func.count(party.sire_id).label("wins")) \
             .select_from(party).join(Entry).join(Running).join(Race) \
             .filter_by(surface = surface).group_by(party.sire_id) 
         subq = (sires.cte())
-        stmt = db.select(party.name, subq.c.wins).select_from(party) \
-            .join(subq, party.id == subq.c.sire_id) \
+        stmts[surface] = db.select(party.id, party.name, subq.c.wins) \
+            .select_from(party).join(subq, party.id == subq.c.sire_id) \
             .order_by(subq.c.wins.desc())
       else:
-        stmt = db.select(party.first_name, party.last_name, \
-            func.count(party.id).label("wins")).select_from(party) \
-            .join(Entry).join(Running) \
-            .join(Race).filter_by(surface = surface).group_by(party.id) \
+        stmts[surface] = db.select(party.id, party.first_name, \
+            party.last_name, func.count(party.id).label("wins")) \
+            .select_from(party).join(Entry).join(Running) \
+            .join(Race).filter_by(surface = surface) \
+            .group_by(party.id, party.first_name, party.last_name) \
             .order_by(func.count(party.id).desc())
-            
-      result = db.session.execute(stmt).fetchall()
-      surf_wins[surface] = self._get_aggregate_winners_where_tie(result)
 
-    return surf_wins
+    return stmts
 
-  def wins_by_race_type(self, party) -> dict[dict[int, list]]:
+  def _wins_by_race_type_stmts(self, party) -> dict:
     avail_types = {"maiden": ["MSW", "MCL"], "claim": ["MCL", "CLM"], "allowance": ["ALW"], \
         "stakes": ["STK", "STR"]}
-
-    wins_by_type = {}
+    stmts = {}
 
     for race_type in avail_types:
       if party == Horse:
@@ -110,28 +379,25 @@ class DBHandler(object):
             .join(Race).where(Race.type.in_(avail_types[race_type])) \
             .group_by(party.sire_id)
         subq = sires.cte()
-        stmt = db.select(party.name, subq.c.wins).select_from(party) \
-            .join(subq, party.id == subq.c.sire_id) \
+        stmts[race_type] = db.select(party.id, party.name, subq.c.wins) \
+            .select_from(party).join(subq, party.id == subq.c.sire_id) \
             .order_by(subq.c.wins.desc())
       else:
-        stmt = db.select(party.first_name, party.last_name, \
-            func.count(party.id).label("wins")).select_from(party) \
-            .join(Entry).join(Running).join(Race) \
-            .where(Race.type.in_(avail_types[race_type])).group_by(party.id) \
+        stmts[race_type] = db.select(party.id, party.first_name, \
+            party.last_name, func.count(party.id).label("wins")) \
+            .select_from(party).join(Entry).join(Running).join(Race) \
+            .where(Race.type.in_(avail_types[race_type])) \
+            .group_by(party.id, party.first_name, party.last_name) \
             .order_by(func.count(party.id).desc())
 
-      result = db.session.execute(stmt).fetchall()
-      wins_by_type[race_type] = self._get_aggregate_winners_where_tie(result)
-
-    return wins_by_type
-
+    return stmts
 
-  def wins_by_distance(self, party) -> dict[dict[int, list]]:
-    wins_by_dist_class = {}
+  def _wins_by_distance_stmts(self, party) -> dict:
     #by horse racing terms, a sprint is 7 furlongs or less
     #route is somewhat arbitrary, but some international races can be 4 miles+
     distance_cutoffs = {"sprint": Race.distance <= 7, \
         "route": Race.distance > 7}
+    stmts = {}
 
     for cut in distance_cutoffs:
       if party == Horse:
@@ -140,52 +406,229 @@ class DBHandler(object):
             .join(Race).where(distance_cutoffs[cut]) \
             .group_by(party.sire_id)
         subq = sires.cte()
-        stmt = db.select(party.name, subq.c.wins).select_from(party) \
-            .join(subq, party.id == subq.c.sire_id) \
+        stmts[cut] = db.select(party.id, party.name, subq.c.wins) \
+            .select_from(party).join(subq, party.id == subq.c.sire_id) \
             .order_by(subq.c.wins.desc())
       else:
-        stmt = db.select(party.first_name, party.last_name, \
+        stmts[cut] = db.select(party.id, party.first_name, party.last_name, \
             func.count(party.id).label("wins")).select_from(party) \
             .join(Entry).join(Running).join(Race) \
-            .where(distance_cutoffs[cut]).group_by(party.id) \
+            .where(distance_cutoffs[cut]) \
+            .group_by(party.id, party.first_name, party.last_name) \
             .order_by(func.count(party.id).desc())
 
-      result = db.session.execute(stmt).fetchall()
-      wins_by_dist_class[cut] = self._get_aggregate_winners_where_tie(result)
-
-    return wins_by_dist_class
-
-  def all_aggregate_wins(self, party) -> dict:
-    wins_by_stat_type = {}
-
-    wins_by_stat_type["all_time"] = self.wins_all_time(party)
-    wins_by_stat_type["surface"] = self.wins_by_surface_type(party)
-    wins_by_stat_type["race_type"] = self.wins_by_race_type(party)
-    wins_by_stat_type["distance"] = self.wins_by_distance(party)
-
-    return wins_by_stat_type
-
-  def _get_aggregate_winners_where_tie(self, results_lst):
-    wins_with_ties = {}
-    top_three_wins = []
-    top = results_lst[0].wins
-    temp_results = results_lst[:]
-    while len(wins_with_ties) < 3:
-      wins_with_ties[top] = []
-      cutoff = sum(1 for sire in temp_results if sire.wins == top)
-      wins_with_ties[top] += temp_results[:cutoff]
-      temp_results = temp_results[cutoff:]
-      top = temp_results[0].wins
-
-    return wins_with_ties
-
-
-  def _get_total_races_indexed(self) -> int:
-    stmt = db.select(func.count(Running.id)).select_from(Running)
-    result = db.session.execute(stmt).scalar()
+    return stmts
 
-    return result
+  def _party_names_stmt(self, party, stats: dict):
+    ids = {row["id"] for groups in stats.values() for rows in groups.values() \
+        for row in rows}
+    if party == Horse:
+      stmt = db.select(party.id, party.name).where(party.id.in_(ids))
+    else:
+      stmt = db.select(party.id, party.first_name, party.last_name) \
+          .where(party.id.in_(ids))
+
+    return stmt
+
+  def _figure_leaders_stmt(self, figure: str, limit: int):
+    column = Figure.pace_figure if figure == "pace" else Figure.speed_figure
+    stmt = db.select(Figure.speed_figure, Figure.pace_figure, \
+        Figure.par_seconds, Figure.track_variant, Running.date, \
+        Running.num_on_day, Running.final_seconds, \
+        Running.half_mile_seconds, Race.type, \
+        Race.name.label("race_name"), Race.distance, Race.surface, \
+        Horse.id.label("horse_id"), Horse.name.label("horse_name")) \
+        .select_from(Figure) \
+        .join(Running, Figure.running_id == Running.id) \
+        .join(Race, Running.race_id == Race.id) \
+        .join(Horse, Running.winner_id == Horse.id) \
+        .where(column.isnot(None)) \
+        .order_by(column.desc()).limit(limit)
+
+
+    return stmt
+
+  def _past_performances_stmt(self, party, party_id, sires: bool):
+    if party == Horse:
+      where = Horse.sire_id == party_id if sires else \
+          Entry.horse_id == party_id
+    elif party == Jockey:
+      where = Entry.jockey_id == party_id
+    else:
+      where = Entry.trainer_id == party_id
+
+    stmt = db.select(Running.date, Running.num_on_day, Running.field_size, \
+        Running.off_track, Running.half_mile_seconds, Running.final_seconds, \
+        Race.type, Race.name.label("race_name"), Race.grade, Race.distance, \
+        Race.surface, Entry.post_position, Entry.odds, \
+        (Running.winner_id == Entry.horse_id).label("won"), \
+        Horse.id.label("horse_id"), Horse.name.label("horse_name"), \
+        Jockey.id.label("jockey_id"), \
+        Jockey.first_name.label("jockey_first_name"), \
+        Jockey.last_name.label("jockey_last_name"), \
+        Trainer.id.label("trainer_id"), \
+        Trainer.first_name.label("trainer_first_name"), \
+        Trainer.last_name.label("trainer_last_name"), \
+        Track.abbreviation.label("last_raced_at"), Entry.last_raced) \
+        .select_from(Entry) \
+        .join(Running, Entry.running_id == Running.id) \
+        .join(Race, Running.race_id == Race.id) \
+        .join(Horse, Entry.horse_id == Horse.id) \
+        .outerjoin(Jockey, Entry.jockey_id == Jockey.id) \
+        .outerjoin(Trainer, Entry.trainer_id == Trainer.id) \
+        .outerjoin(Track, Entry.last_raced_track_id == Track.id) \
+        .where(where) \
+        .order_by(Running.date.desc(), Running.num_on_day.desc())
+
+
+    return stmt
+
+  def _total_races_stmt(self):
+    return db.select(func.count(Running.id)).select_from(Running)
+
+  def _data_version_stmt(self):
+    return db.select(func.max(DataLoad.id))
+
+  def _entries_stmt(self):
+    return db.select(Entry.jockey_id, Entry.trainer_id, Horse.sire_id, \
+        Entry.odds, Race.surface, Race.distance) \
+        .select_from(Entry) \
+        .join(Horse, Entry.horse_id == Horse.id) \
+        .join(Running, Entry.running_id == Running.id) \
+        .join(Race, Running.race_id == Race.id) \
+        .where(Running.winner_id == Entry.horse_id)
+
+
+class PrimaryDBHandler(DBHandler):
+  '''
+  DBHandler that runs every read on the primary through db.session, for
+  writers whose output must include rows just committed, such as the
+  aggregate snapshot written after a load.  Replicas and the analytics copy
+  may still be catching up at that point.
 
+  Methods:
+    _execute(stmt):
+      Runs a read on db.session.
+  '''
+  def _execute(self, stmt) -> list:
+    return db.session.execute(stmt).fetchall()
 
 
+class AsyncDBHandler(DBHandler):
+  '''
+  DBHandler variant whose queries are coroutines run on async_db's asyncio
+  engine.  It builds the same statements as DBHandler, but independent
+  queries are issued together: the nine aggregate queries for a page run
+  concurrently on separate connections instead of one after another, so a
+  page takes about as long as its slowest query.  Results are the same as
+  DBHandler's, and the aggregate snapshot is used in the same way.
+  Coroutines must be run on the async_db event loop, eg. with
+  async_db.call().
 
+  Methods:
+    data_version(), wins_all_time(party), wins_by_surface_type(party),
+    wins_by_race_type(party), wins_by_distance(party),
+    all_aggregate_wins(party, live), party_statistics(party, min_wins),
+    figure_leaders(figure, limit), past_performances(party, party_id,
+    sires):
+      Coroutine versions of the DBHandler methods.
+
+    _execute(stmt):
+      Runs a read on the async engine.
+
+    _execute_all(stmts):
+      Runs a dict of statements concurrently and finds the top three
+      (with ties) from each.
+  '''
+  def __init__(self):
+    super().__init__()
+    self._stats_lock = asyncio.Lock()
+
+  async def data_version(self) -> int:
+    if self._version_due():
+      self._set_version(await self._get_data_version())
+
+    return self._version
+
+  @track_method
+  async def wins_all_time(self, party) -> dict[dict[int, list]]:
+    result = await self._execute(self._wins_all_time_stmt(party))
+
+    return self._get_aggregate_winners_where_tie(result)
+
+  @track_method
+  async def wins_by_surface_type(self, party) -> dict[dict[int, list]]:
+    return await self._execute_all(self._wins_by_surface_stmts(party))
+
+  @track_method
+  async def wins_by_race_type(self, party) -> dict[dict[int, list]]:
+    return await self._execute_all(self._wins_by_race_type_stmts(party))
+
+  @track_method
+  async def wins_by_distance(self, party) -> dict[dict[int, list]]:
+    return await self._execute_all(self._wins_by_distance_stmts(party))
+
+  @track_method
+  async def all_aggregate_wins(self, party, live: bool = False) -> dict:
+    if not live:
+      measures = {Horse: "sires", Jockey: "jockeys", Trainer: "trainers"}
+      snapshot = aggregate_snapshot.aggregates(measures[party], \
+          await self.data_version())
+      if snapshot is not None:
+        return snapshot
+
+    all_time, surface, race_type, distance = await asyncio.gather( \
+        self.wins_all_time(party), self.wins_by_surface_type(party), \
+        self.wins_by_race_type(party), self.wins_by_distance(party))
+
+    return {"all_time": all_time, "surface": surface, \
+        "race_type": race_type, "distance": distance}
+
+  @track_method
+  async def party_statistics(self, party, min_wins: int = 3) -> dict:
+    measures = {Horse: "sires", Jockey: "jockeys", Trainer: "trainers"}
+    engine = await self._get_stats_engine()
+    stats = engine.all_rates(measures[party], min_wins)
+    names = await self._execute(self._party_names_stmt(party, stats))
+
+    return self._add_party_names(stats, names)
+
+  @track_method
+  async def figure_leaders(self, figure: str = "speed", \
+      limit: int = 25) -> list:
+    return await self._execute(self._figure_leaders_stmt(figure, limit))
+
+  @track_method
+  async def past_performances(self, party, party_id, sires = False) -> list:
+    return await self._execute(self._past_performances_stmt(party, \
+        party_id, sires))
+
+  async def _execute(self, stmt) -> list:
+    return await async_db.execute(stmt)
+
+  async def _execute_all(self, stmts: dict) -> dict:
+    results = await asyncio.gather(*(self._execute(stmt) \
+        for stmt in stmts.values()))
+
+    return {key: self._get_aggregate_winners_where_tie(result) \
+        for key, result in zip(stmts, results)}
+
+  async def _get_data_version(self) -> int:
+    result = await self._execute(self._data_version_stmt())
+
+    return result[0][0] or 0
+
+  @track_method
+  async def _get_stats_engine(self) -> StatsEngine:
+    # Building the engine is CPU bound, so it runs off the event loop, and
+    # the lock keeps concurrent first requests from loading it twice.
+    version = await self.data_version()
+    async with self._stats_lock:
+      engine = self._stats_engine
+      if engine is None:
+        rows = await self._execute(self._entries_stmt())
+        engine = await asyncio.to_thread(StatsEngine, rows)
+        if self._version == version:
+          self._stats_engine = engine
+
+    return engine
@@ -0,0 +1,464 @@
+import logging
+import os
+import time
+import uuid
+import click
+import numpy as np
+from sqlalchemy import func
+from .files import FileStamp
+from .ids import uuid7_floor
+from .models import Entry, Horse, Running, Race
+from .stats_engine import StatsEngine
+from .metrics import track_method
+from . import db
+
+log = logging.getLogger("data_barn.features")
+
+class FeatureStore(object):
+  '''
+  Handicapping features for scoring upcoming cards.  For every jockey,
+  trainer, and sire it holds starts and wins overall, by surface, and by
+  distance class, plus recent form (starts and wins decayed by age), as
+  dense arrays indexed by party code.  Post position win rates by distance
+  class come from each running's field size and winning post.  The arrays
+  are saved to a file (FEATURES_PATH, by default features.npz in the
+  instance folder) and each worker reloads it when it is replaced.
+
+  Refreshes are incremental: the store remembers the highest version 7
+  running id it has counted (or, if there were none, the time of the
+  refresh), and since those are time-ordered keys, only version 7 runnings
+  inserted since then (and their entries) are read and added to the arrays.
+  Random (version 4) keys never move the watermark, since they sort
+  anywhere.  Ids are made by the client, so a running can also commit with
+  an id below the watermark (a loader host with a slow clock, a long
+  transaction, or a random key); the store therefore also counts the
+  runnings it holds, and when the database has a different number after an
+  incremental refresh, it rebuilds.  Older form is decayed to the newest
+  race date as it moves forward.  Rebuild after editing existing runnings.
+
+  Party win rates need losing starts.  Data that records only each race's
+  winner (like the Keeneland CSV) has a win in every start, so the rates
+  say nothing; score() then leaves them out and scores by odds and post
+  position alone.
+
+  Attributes:
+    FORMAT: int
+      Bumped when the arrays saved change; files with another format are
+      ignored.
+
+    KINDS: tuple[str]
+      Party kinds, as named in the dashboard URLs.
+
+    SPLITS: list[str]
+      Columns of the starts and wins arrays: overall, each of
+      StatsEngine.SURFACES, then each of StatsEngine.DISTANCES.
+
+    MAX_POST: int
+      Highest post position tracked; higher posts share its column.
+
+    path: str
+      Features file.
+
+    half_life: float
+      Days for a start's weight in recent form to halve
+      (FEATURE_FORM_HALF_LIFE).
+
+    prior: float
+      Pseudo-starts at the overall win rate added to every rate
+      (FEATURE_PRIOR), so parties with few starts score near average.
+
+    CEILING: int
+      Milliseconds past the current time that incremental refreshes read
+      running ids up to, to skip random keys above every time-ordered one.
+
+  Methods:
+    init_app(app):
+      Reads the config, loads the features file if present, and adds the
+      "flask refresh-features" command.
+
+    load():
+      Reads the features file, reloading it if it has been replaced.
+
+    refresh(rebuild):
+      Adds runnings inserted since the last refresh (or every running if
+      rebuild is True) and writes a new features file.
+
+    score(card):
+      Scores every entry of a card in one vectorized pass.
+
+    _update(state, entries, runnings):
+      Adds entry and running rows to the arrays in state.
+
+    _rate(starts, wins, base):
+      Win rate shrunk toward base by prior pseudo-starts.
+  '''
+  FORMAT = 3
+  CEILING = 3600000
+  KINDS = ("jockeys", "trainers", "sires")
+  SPLITS = ["all"] + StatsEngine.SURFACES + StatsEngine.DISTANCES
+  MAX_POST = 20
+
+  def __init__(self) -> None:
+    self.path = ""
+    self.half_life = 90.0
+    self.prior = 20.0
+    self._state = None
+    self._file = FileStamp()
+
+  def init_app(self, app) -> None:
+    self.path = app.config.get("FEATURES_PATH") or \
+        os.path.join(app.instance_path, "features.npz")
+    self.half_life = app.config.get("FEATURE_FORM_HALF_LIFE", self.half_life)
+    self.prior = app.config.get("FEATURE_PRIOR", self.prior)
+    self._state = None
+    self._file.reset(self.path)
+    self.load()
+
+    @app.cli.command("refresh-features")
+    @click.option("--rebuild", is_flag = True, \
+        help = "Recount every running instead of only new ones.")
+    def refresh_features_command(rebuild):
+      '''Add new runnings to the handicapping features.'''
+      print(f'Added {self.refresh(rebuild)} entries to {self.path}')
+
+  def load(self) -> bool:
+    '''
+    Loads the features file if it exists and has changed since last loaded.
+
+    Returns: bool
+      True if features are loaded.
+    '''
+    if not self._file.changed():
+      return self._state is not None
+
+    try:
+      with np.load(self.path, allow_pickle = False) as saved:
+        arrays = {name: saved[name] for name in saved.files}
+      if int(arrays["format"]) != self.FORMAT:
+        log.warning("ignoring features %s: format %d", self.path, \
+            int(arrays["format"]))
+        return self._state is not None
+    except (OSError, ValueError, KeyError) as e:
+      log.warning("ignoring features %s: %s", self.path, e)
+      return self._state is not None
+
+    arrays["codes"] = {kind: {uuid.UUID(hex): code for code, hex in \
+        enumerate(arrays[f'{kind}_ids'])} for kind in self.KINDS}
+    self._state = arrays
+
+    return True
+
+  @track_method
+  def refresh(self, rebuild: bool = False) -> int:
+    '''
+    Counts runnings inserted since the last refresh and writes the updated
+    features, rebuilding instead if the database then holds a different
+    number of runnings than the features.  Runs after each DataLoader load.
+
+    Parameters:
+      rebuild: bool
+        If True, discards the saved features and counts every running.
+
+    Returns: int
+      Number of entries added.
+    '''
+    state = None if rebuild or not self.load() else dict(self._state)
+    if state is None:
+      state = self._empty()
+
+    started = time.time_ns() // 1000000
+    after = state["watermark"].item()
+    entries = db.select(Running.id, Running.date, Entry.jockey_id, \
+        Entry.trainer_id, Horse.sire_id, Race.surface, Race.distance, \
+        (Running.winner_id == Entry.horse_id).label("won")) \
+        .select_from(Entry) \
+        .join(Horse, Entry.horse_id == Horse.id) \
+        .join(Running, Entry.running_id == Running.id) \
+        .join(Race, Running.race_id == Race.id) \
+        .where(Entry.scratch.isnot(True))
+    runnings = db.select(Running.id, Running.date, Running.field_size, \
+        Running.winning_post, Race.distance) \
+        .select_from(Running).join(Race, Running.race_id == Race.id)
+    if after:
+      ceiling = uuid7_floor(started + self.CEILING)
+      entries = entries.where(Running.id > uuid.UUID(after), \
+          Running.id < ceiling)
+      runnings = runnings.where(Running.id > uuid.UUID(after), \
+          Running.id < ceiling)
+    entries = db.session.execute(entries).all()
+    runnings = db.session.execute(runnings).all()
+    if after:
+      # Random keys in the range were counted by the last rebuild.
+      entries = [row for row in entries if row.id.version == 7]
+      runnings = [row for row in runnings if row.id.version == 7]
+
+    self._update(state, entries, runnings)
+    if not state["watermark"].item():
+      state["watermark"] = np.array(uuid7_floor(started).hex)
+    if after:
+      # Counted after the reads, so a running the watermark skipped shows
+      # up as a shortfall.
+      total = db.session.execute(db.select(func.count()) \
+          .select_from(Running)).scalar_one()
+      if total != int(state["runnings"]):
+        log.info("features hold %d of %d runnings, rebuilding", \
+            int(state["runnings"]), total)
+        return self.refresh(rebuild = True)
+    arrays = {name: value for name, value in state.items() \
+        if name != "codes"}
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+    tmp = self.path + ".tmp"
+    with open(tmp, "wb") as f:
+      np.savez(f, **arrays)
+    os.replace(tmp, self.path)
+    self.load()
+
+    return len(entries)
+
+  def score(self, card: list[dict]) -> list[dict]:
+    '''
+    Scores a card.  Each entry's score is the log of its market win
+    probability (from odds, or an even share of its race without odds) plus
+    the average log lift of its jockey's, trainer's, and sire's overall,
+    surface, distance, and recent form win rates over the overall win rate,
+    plus the lift of its post position.  Scores are normalized within each
+    race into win probabilities.  Unknown parties and missing fields
+    contribute no lift, and party rates are left out entirely while the
+    features have no losing starts (winners-only data).
+
+    Parameters:
+      card: list[dict]
+        Entries with any of "race" (a label grouping entries into races),
+        "horse", "jockey", "trainer", and "sire" (ids), "surface",
+        "distance" (furlongs), "post", and "odds".
+
+    Returns: list[dict]
+      For each entry in order, its race and horse, score, probability,
+      and the shrunk win rates used.  A party's win rate is None if it is
+      unknown or the features have no losing starts.  Call only once load()
+      is True.
+
+    Raises: ValueError
+      If distance, post, or odds is not a number.
+    '''
+    state = self._state
+    count = len(card)
+    surfaces = {s.lower(): i for i, s in enumerate(StatsEngine.SURFACES)}
+    surface = np.fromiter((surfaces.get(str(e.get("surface") or "") \
+        .strip().lower(), -1) for e in card), dtype = np.int64, count = count)
+    distance = np.fromiter((np.nan if e.get("distance") is None else \
+        float(e["distance"]) for e in card), dtype = float, count = count)
+    post = np.fromiter((int(e.get("post") or 0) for e in card), \
+        dtype = np.int64, count = count).clip(0, self.MAX_POST)
+    odds = np.fromiter((np.nan if e.get("odds") is None else \
+        float(e["odds"]) for e in card), dtype = float, count = count)
+    labels = {}
+    race = np.fromiter((labels.setdefault(str(e.get("race", "")), \
+        len(labels)) for e in card), dtype = np.int64, count = count)
+    dist_class = np.where(np.isnan(distance), -1, \
+        np.where(distance <= 7, 0, 1))
+
+    # Market probability, or an even share of the race without odds.
+    field = np.bincount(race, minlength = len(labels))[race]
+    market = np.where(np.isnan(odds) | (odds < 0), 1 / field, \
+        1 / (np.nan_to_num(odds) + 1))
+    logit = np.log(market)
+
+    starts, wins = state["totals"]
+    base = wins / starts if starts else 0.0
+    # With a win in every start, every rate is 1 and every lift 0.
+    informative = 0 < wins < starts
+    result = [{"race": e.get("race"), "horse": e.get("horse")} for e in card]
+    surface_col = np.where(surface >= 0, 1 + surface, 0)
+    distance_col = np.where(dist_class >= 0, \
+        1 + len(StatsEngine.SURFACES) + dist_class, 0)
+    rows = np.arange(count)
+
+    for kind, field_name in zip(self.KINDS, ("jockey", "trainer", "sire")):
+      lookup = state["codes"][kind]
+      codes = np.fromiter((lookup.get(self._uuid(e.get(field_name)), -1) \
+          for e in card), dtype = np.int64, count = count)
+      kind_starts = self._take(state[f'{kind}_starts'], codes)
+      kind_wins = self._take(state[f'{kind}_wins'], codes)
+      form_starts = self._take(state[f'{kind}_form_starts'], codes)
+      form_wins = self._take(state[f'{kind}_form_wins'], codes)
+
+      overall = self._rate(kind_starts[:, 0], kind_wins[:, 0], base)
+      rates = [overall, \
+          self._rate(kind_starts[rows, surface_col], \
+              kind_wins[rows, surface_col], base), \
+          self._rate(kind_starts[rows, distance_col], \
+              kind_wins[rows, distance_col], base), \
+          self._rate(form_starts, form_wins, base)]
+      if informative:
+        logit += np.mean([np.log(rate / base) for rate in rates], axis = 0)
+      for i, rate in enumerate(overall):
+        result[i][f'{field_name}_win_rate'] = float(rate) \
+            if informative and codes[i] >= 0 else None
+
+    # Unknown distances (class -1) use the last row, both classes pooled.
+    post_starts = np.vstack([state["post_starts"], \
+        state["post_starts"].sum(axis = 0)])[dist_class, post]
+    post_wins = np.vstack([state["post_wins"], \
+        state["post_wins"].sum(axis = 0)])[dist_class, post]
+    post_base = state["post_wins"].sum() / max(state["post_starts"].sum(), 1)
+    post_rate = self._rate(np.where(post > 0, post_starts, 0), \
+        np.where(post > 0, post_wins, 0), post_base)
+    if post_base > 0:
+      logit += np.log(post_rate / post_base)
+
+    # Softmax within each race.
+    top = np.full(len(labels), -np.inf)
+    np.maximum.at(top, race, logit)
+    weight = np.exp(logit - top[race])
+    probability = weight / np.bincount(race, weights = weight, \
+        minlength = len(labels))[race]
+
+    for i, row in enumerate(result):
+      row.update({"score": float(logit[i]), \
+          "probability": float(probability[i]), \
+          "post_win_rate": float(post_rate[i])})
+
+    return result
+
+  def _update(self, state: dict, entries: list, runnings: list) -> None:
+    '''
+    Adds entries and runnings to the arrays in state, decaying existing
+    form to the newest race date first.
+
+    Parameters:
+      state: dict
+        Arrays from the features file, or _empty().
+      entries: list
+        Rows of (running id, date, jockey id, trainer id, sire id, surface,
+        distance, won).
+      runnings: list
+        Rows of (running id, date, field size, winning post, distance).
+    '''
+    if not runnings:
+      return
+    newest = max(row.date for row in runnings).toordinal()
+    as_of = max(int(state["as_of"]), newest)
+    decay = 0.5 ** ((as_of - int(state["as_of"])) / self.half_life)
+    state["as_of"] = np.array(as_of)
+    state["runnings"] = np.array(int(state["runnings"]) + len(runnings))
+    keys = [row.id for row in runnings if row.id.version == 7]
+    if state["watermark"].item():
+      keys.append(uuid.UUID(state["watermark"].item()))
+    if keys:
+      state["watermark"] = np.array(max(keys).hex)
+
+    count = len(entries)
+    ncol = len(self.SPLITS)
+    surfaces = {s: i for i, s in enumerate(StatsEngine.SURFACES)}
+    surface = np.fromiter((surfaces.get(row.surface, -1) for row in entries), \
+        dtype = np.int64, count = count)
+    distance = np.fromiter((np.nan if row.distance is None else row.distance \
+        for row in entries), dtype = float, count = count)
+    dist_class = np.where(np.isnan(distance), -1, \
+        np.where(distance <= 7, 0, 1))
+    won = np.fromiter((bool(row.won) for row in entries), dtype = float, \
+        count = count)
+    age = np.fromiter((as_of - row.date.toordinal() for row in entries), \
+        dtype = float, count = count)
+    weight = 0.5 ** (age / self.half_life)
+
+    state["totals"] = state["totals"] + [count, won.sum()]
+    for kind, column in zip(self.KINDS, (2, 3, 4)):
+      ids = list(state[f'{kind}_ids'])
+      lookup = state["codes"][kind] = dict(state["codes"][kind])
+      codes = np.fromiter((-1 if row[column] is None else \
+          lookup.setdefault(row[column], len(lookup)) for row in entries), \
+          dtype = np.int64, count = count)
+      ids.extend(key.hex for key in list(lookup)[len(ids):])
+      size = len(ids)
+      state[f'{kind}_ids'] = np.array(ids, dtype = "U32")
+
+      keep = codes >= 0
+      starts = np.zeros((size, ncol))
+      wins = np.zeros((size, ncol))
+      old = len(state[f'{kind}_starts'])
+      starts[:old] = state[f'{kind}_starts']
+      wins[:old] = state[f'{kind}_wins']
+      for col, valid in ((np.zeros(count, dtype = np.int64), keep), \
+          (1 + surface, keep & (surface >= 0)), \
+          (1 + len(StatsEngine.SURFACES) + dist_class, \
+              keep & (dist_class >= 0))):
+        key = codes[valid] * ncol + col[valid]
+        starts += np.bincount(key, minlength = size * ncol) \
+            .reshape(size, ncol)
+        wins += np.bincount(key, weights = won[valid], \
+            minlength = size * ncol).reshape(size, ncol)
+      state[f'{kind}_starts'] = starts
+      state[f'{kind}_wins'] = wins
+
+      form_starts = np.zeros(size)
+      form_wins = np.zeros(size)
+      form_starts[:old] = state[f'{kind}_form_starts'] * decay
+      form_wins[:old] = state[f'{kind}_form_wins'] * decay
+      form_starts += np.bincount(codes[keep], weights = weight[keep], \
+          minlength = size)
+      form_wins += np.bincount(codes[keep], weights = (weight * won)[keep], \
+          minlength = size)
+      state[f'{kind}_form_starts'] = form_starts
+      state[f'{kind}_form_wins'] = form_wins
+
+    # Every post up to the field size started; the winning post won.
+    count = len(runnings)
+    field = np.fromiter((row.field_size or 0 for row in runnings), \
+        dtype = np.int64, count = count)
+    winner = np.fromiter((row.winning_post or 0 for row in runnings), \
+        dtype = np.int64, count = count).clip(0, self.MAX_POST)
+    distance = np.fromiter((np.nan if row.distance is None else row.distance \
+        for row in runnings), dtype = float, count = count)
+    dist_class = np.where(np.isnan(distance), -1, \
+        np.where(distance <= 7, 0, 1))
+    posts = np.arange(self.MAX_POST + 1)
+    started = (posts >= 1) & (posts[None, :] <= field[:, None])
+    post_starts = state["post_starts"].copy()
+    post_wins = state["post_wins"].copy()
+    for d in range(len(StatsEngine.DISTANCES)):
+      rows = dist_class == d
+      post_starts[d] += started[rows].sum(axis = 0)
+      post_starts[d, self.MAX_POST] += np.maximum(field[rows] - \
+          self.MAX_POST, 0).sum()
+      post_wins[d] += np.bincount(winner[rows & (winner > 0)], \
+          minlength = self.MAX_POST + 1)
+    state["post_starts"] = post_starts
+    state["post_wins"] = post_wins
+
+  def _empty(self) -> dict:
+    state = {"format": np.array(self.FORMAT), "as_of": np.array(0), \
+        "watermark": np.array(""), "runnings": np.array(0), \
+        "totals": np.zeros(2), \
+        "post_starts": np.zeros((len(StatsEngine.DISTANCES), \
+            self.MAX_POST + 1)), \
+        "post_wins": np.zeros((len(StatsEngine.DISTANCES), \
+            self.MAX_POST + 1)), \
+        "codes": {kind: {} for kind in self.KINDS}}
+    for kind in self.KINDS:
+      state[f'{kind}_ids'] = np.array([], dtype = "U32")
+      state[f'{kind}_starts'] = np.zeros((0, len(self.SPLITS)))
+      state[f'{kind}_wins'] = np.zeros((0, len(self.SPLITS)))
+      state[f'{kind}_form_starts'] = np.zeros(0)
+      state[f'{kind}_form_wins'] = np.zeros(0)
+
+    return state
+
+  def _rate(self, starts: np.ndarray, wins: np.ndarray, \
+      base: float) -> np.ndarray:
+    return (wins + self.prior * base) / (starts + self.prior)
+
+  def _take(self, array: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    # Rows of array for each code, zeros for unknown parties (code -1).
+    taken = np.zeros((len(codes),) + array.shape[1:])
+    known = codes >= 0
+    taken[known] = array[codes[known]]
+
+    return taken
+
+  def _uuid(self, value) -> uuid.UUID | None:
+    try:
+      return uuid.UUID(str(value))
+    except ValueError:
+      return None
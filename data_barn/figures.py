@@ -0,0 +1,169 @@
+import datetime
+import numpy as np
+from sqlalchemy import delete, insert
+from .models import Running, Race, Figure
+from . import db
+
+class FigureBuilder(object):
+  '''
+  Batch job that computes par times, daily track variants, and speed and
+  pace figures for every running.  All runnings are loaded in one query and
+  the calculations are vectorized with NumPy; only the figures for race days
+  touched by a load are written back.
+
+  Par time is the median time for a course, where a course is a (track,
+  surface, distance) combination.  A running's deviation is its time minus
+  par as a fraction of par.  The daily variant is the mean deviation of all
+  runnings on the same track, surface, and day, shrunk toward zero by
+  VARIANT_PRIOR so a single race does not define its own variant.  A figure
+  of 100 is a par performance on a normal day; each 0.1% faster than
+  variant-adjusted par adds one point (POINTS), which works out to roughly
+  14 points per second at six furlongs and 9 at nine furlongs.
+
+  Pace figures rate the winner's own first half mile.  The recorded half
+  mile time is the leader's, so the winner's time is that plus
+  LENGTH_SECONDS for each length it was behind (half_mile_winner_position
+  is negative when behind and positive when leading).
+
+  Attributes:
+    POINTS: int
+      Figure points per unit of fractional deviation from par.
+
+    VARIANT_PRIOR: float
+      Pseudo-count of par runnings added to every race day.
+
+    LENGTH_SECONDS: float
+      Seconds per length behind the leader.
+
+    CHUNK: int
+      Number of figure records written per statement.
+
+  Methods:
+    refresh(dates):
+      Recomputes figures and writes them for runnings on the given dates.
+
+    rebuild():
+      Recomputes and writes figures for every running.
+
+    _winner_half(halves, positions):
+      The winner's half mile time from the leader's and its position.
+
+    _figures(times, courses, days):
+      Par, variant, and figure for each running from one set of times.
+
+    _group_medians(values, groups):
+      Median of values within each group, broadcast back to each row.
+
+    _factorize(values):
+      Converts a sequence of hashable keys into integer codes.
+  '''
+  POINTS = 1000
+  VARIANT_PRIOR = 2.0
+  LENGTH_SECONDS = 0.2
+  CHUNK = 5000
+
+  def refresh(self, dates: set[datetime.date] | None = None) -> int:
+    '''
+    Recomputes par times and variants over all runnings, then replaces the
+    figure records for runnings on the given dates.  Pars drift slowly as
+    data is added, so older days keep their figures until rebuild() is run.
+
+    Parameters:
+      dates: set[datetime.date] | None
+        Race days affected by a load.  None refreshes every running.
+
+    Returns: int
+      Number of figure records written.
+    '''
+    stmt = db.select(Running.id, Running.date, Race.track_id, Race.surface, \
+        Race.distance, Running.final_seconds, Running.half_mile_seconds, \
+        Running.half_mile_winner_position) \
+        .select_from(Running).join(Race, Running.race_id == Race.id)
+    rows = db.session.execute(stmt).fetchall()
+    if not rows:
+      return 0
+
+    ids, ran_on, tracks, surfaces, distances, finals, halves, positions = \
+        zip(*rows)
+    courses = self._factorize(zip(tracks, surfaces, distances))
+    days = self._factorize(zip(tracks, surfaces, ran_on))
+    final = np.array([t if t else np.nan for t in finals], dtype = float)
+    half = self._winner_half(halves, positions)
+
+    par, variant, speed = self._figures(final, courses, days)
+    half_par, pace_variant, pace = self._figures(half, courses, days)
+
+    if dates is None:
+      selected = np.arange(len(ids))
+    else:
+      selected = np.flatnonzero(np.fromiter((d in dates for d in ran_on), \
+          dtype = bool, count = len(ran_on)))
+
+    def _value(arr, i, cast = float):
+      return None if np.isnan(arr[i]) else cast(arr[i])
+
+    records = [{"running_id": ids[i], "par_seconds": _value(par, i), \
+        "half_mile_par_seconds": _value(half_par, i), \
+        "track_variant": _value(variant, i), \
+        "pace_variant": _value(pace_variant, i), \
+        "speed_figure": _value(np.round(speed), i, int), \
+        "pace_figure": _value(np.round(pace), i, int)} for i in selected]
+
+    if dates is None:
+      db.session.execute(delete(Figure))
+    for start in range(0, len(records), self.CHUNK):
+      chunk = records[start:start + self.CHUNK]
+      if dates is not None:
+        db.session.execute(delete(Figure).where(Figure.running_id \
+            .in_([r["running_id"] for r in chunk])))
+      db.session.execute(insert(Figure), chunk)
+    db.session.commit()
+
+    return len(records)
+
+  def rebuild(self) -> int:
+    return self.refresh(None)
+
+  def _winner_half(self, halves, positions) -> np.ndarray:
+    half = np.array([t if t else np.nan for t in halves], dtype = float)
+    position = np.array([np.nan if p is None else p for p in positions], \
+        dtype = float)
+
+    return half + np.maximum(-position, 0) * self.LENGTH_SECONDS
+
+  def _figures(self, times: np.ndarray, courses: np.ndarray, \
+      days: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    par = self._group_medians(times, courses)
+    deviation = (times - par) / par
+
+    known = ~np.isnan(deviation)
+    total = np.bincount(days[known], weights = deviation[known], \
+        minlength = days.max() + 1)
+    count = np.bincount(days[known], minlength = days.max() + 1)
+    variant = (total / (count + self.VARIANT_PRIOR))[days]
+    figure = 100 - self.POINTS * (deviation - variant)
+
+    return par, variant, figure
+
+  def _group_medians(self, values: np.ndarray, \
+      groups: np.ndarray) -> np.ndarray:
+    known = ~np.isnan(values)
+    vals = values[known]
+    grps = groups[known]
+    order = np.lexsort((vals, grps))
+    vals = vals[order]
+
+    counts = np.bincount(grps, minlength = groups.max() + 1)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(len(counts), np.nan)
+    has = counts > 0
+    lower = starts[has] + (counts[has] - 1) // 2
+    upper = starts[has] + counts[has] // 2
+    medians[has] = (vals[lower] + vals[upper]) / 2
+
+    return medians[groups]
+
+  def _factorize(self, values) -> np.ndarray:
+    lookup = {}
+    return np.array([lookup.setdefault(v, len(lookup)) for v in values], \
+        dtype = np.int64)
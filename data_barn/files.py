@@ -0,0 +1,49 @@
+import os
+import threading
+
+class FileStamp(object):
+  '''
+  Notices when a file that writers replace with os.replace() (the aggregate
+  snapshot and the features file) has been replaced, by its inode,
+  modification time, and size, so each worker re-reads it only after a new
+  copy is written.
+
+  Attributes:
+    path: str
+      File watched.
+
+  Methods:
+    reset(path):
+      Watches path, forgetting the last file seen.
+
+    changed():
+      True the first time a new or replaced file is seen.
+  '''
+  def __init__(self, path: str = "") -> None:
+    self.path = path
+    self._stamp = None
+    self._lock = threading.Lock()
+
+  def reset(self, path: str) -> None:
+    with self._lock:
+      self.path = path
+      self._stamp = None
+
+  def changed(self) -> bool:
+    '''
+    Returns: bool
+      True if the file exists and differs from the one seen by the last
+      call that returned True.  Only one of several concurrent callers
+      gets True for the same file, so it is read once.
+    '''
+    try:
+      stat = os.stat(self.path)
+    except FileNotFoundError:
+      return False
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with self._lock:
+      if stamp == self._stamp:
+        return False
+      self._stamp = stamp
+
+    return True
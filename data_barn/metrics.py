@@ -0,0 +1,259 @@
+import functools
+import hashlib
+import inspect
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+from flask import Response, g, request
+from sqlalchemy import event
+
+slow_log = logging.getLogger("data_barn.slow_queries")
+
+_request_stats = ContextVar("data_barn_request_stats", default = None)
+_method_stack = ContextVar("data_barn_method_stack", default = ())
+_method_calls = {}
+_method_calls_lock = threading.Lock()
+
+def track_method(func):
+  '''
+  Decorator for DBHandler methods.  Queries run while the method is on the
+  stack are attributed to it (and to any tracked method that called it) in
+  the per-method metrics.  Coroutine methods (AsyncDBHandler) are tracked
+  until they finish, including queries in tasks they start.
+  '''
+  name = func.__qualname__
+
+  if inspect.iscoroutinefunction(func):
+    @functools.wraps(func)
+    async def async_wrapper(*args, **kwargs):
+      token = _method_stack.set(_method_stack.get() + (name,))
+      try:
+        return await func(*args, **kwargs)
+      finally:
+        _method_stack.reset(token)
+        with _method_calls_lock:
+          _method_calls[name] = _method_calls.get(name, 0) + 1
+
+    return async_wrapper
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    token = _method_stack.set(_method_stack.get() + (name,))
+    try:
+      return func(*args, **kwargs)
+    finally:
+      _method_stack.reset(token)
+      with _method_calls_lock:
+        _method_calls[name] = _method_calls.get(name, 0) + 1
+
+  return wrapper
+
+def fingerprint(statement: str) -> tuple[str, str]:
+  '''
+  Normalizes a SQL statement so executions that differ only in literal
+  values or bound parameter style group together.
+
+  Returns: tuple[str, str]
+    Short hash of the normalized statement and the normalized text.
+  '''
+  normalized = re.sub(r"'(?:[^']|'')*'", "?", statement)
+  normalized = re.sub(r"\b\d+(?:\.\d+)?\b", "?", normalized)
+  normalized = re.sub(r"%\(\w+\)s|:\w+|\$\d+|%s", "?", normalized)
+  normalized = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", normalized)
+  normalized = " ".join(normalized.split())
+
+  return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+class Metrics(object):
+  '''
+  Per-process request and SQL instrumentation.  SQLAlchemy cursor events
+  count queries, database time, and rows returned for the current request
+  and for each DBHandler method marked with track_method.  Request latency
+  is kept as a histogram per endpoint.  Everything is served as Prometheus
+  text on /metrics.  Each worker process reports its own numbers.
+
+  Statements slower than SLOW_QUERY_MS and requests slower than
+  SLOW_REQUEST_MS are logged to the "data_barn.slow_queries" logger with
+  statement fingerprints.
+
+  Attributes:
+    BUCKETS: tuple[float]
+      Upper bounds in seconds for the request latency histogram.
+
+    MAX_STATEMENTS: int
+      Statements remembered per request for the slow request log.
+
+  Methods:
+    init_app(app, engines):
+      Hooks the engines and the app's request cycle and adds /metrics.
+
+    instrument(engine):
+      Adds the query listeners to an engine opened after init_app.
+
+    add_collector(collect):
+      Adds a callable whose lines are appended to /metrics.
+
+    render():
+      Current metrics in Prometheus text format.
+
+    _before_cursor(conn, cursor, statement, params, context, many):
+    _after_cursor(conn, cursor, statement, params, context, many):
+    _cursor_error(context):
+      SQLAlchemy engine event handlers.  Rows are as reported by the
+      driver's cursor.rowcount, which some drivers leave at -1 for SELECT.
+
+    _before_request():
+    _after_request(response):
+      Flask request hooks.
+  '''
+  BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+  MAX_STATEMENTS = 200
+
+  def __init__(self) -> None:
+    self.slow_query_seconds = 0.2
+    self.slow_request_seconds = 1.0
+    self.requests = {}
+    self.latency = {}
+    self.request_db = {}
+    self.method_db = {}
+    self.extra = []
+    self._lock = threading.Lock()
+
+  def init_app(self, app, engines) -> None:
+    self.slow_query_seconds = app.config.get("SLOW_QUERY_MS", 200) / 1000
+    self.slow_request_seconds = app.config.get("SLOW_REQUEST_MS", 1000) / 1000
+    for engine in engines:
+      self.instrument(engine)
+    app.before_request(self._before_request)
+    app.after_request(self._after_request)
+    app.add_url_rule("/metrics", "metrics", lambda: Response(self.render(), \
+        content_type = "text/plain; version=0.0.4; charset=utf-8"))
+
+  def instrument(self, engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", self._before_cursor):
+      event.listen(engine, "before_cursor_execute", self._before_cursor)
+      event.listen(engine, "after_cursor_execute", self._after_cursor)
+      event.listen(engine, "handle_error", self._cursor_error)
+
+  def add_collector(self, collect) -> None:
+    '''
+    Registers a callable returning extra Prometheus text lines, eg. cache
+    counters, to be appended to /metrics.
+    '''
+    if collect not in self.extra:
+      self.extra.append(collect)
+
+  def render(self) -> str:
+    lines = []
+    with self._lock:
+      lines += ["# TYPE data_barn_http_requests_total counter"]
+      for (endpoint, method, status), count in sorted(self.requests.items()):
+        lines.append(f'data_barn_http_requests_total{{endpoint="{endpoint}"' + \
+            f',method="{method}",status="{status}"}} {count}')
+
+      lines += ["# TYPE data_barn_http_request_duration_seconds histogram"]
+      for endpoint, (buckets, total, count) in sorted(self.latency.items()):
+        name = "data_barn_http_request_duration_seconds"
+        for bound, hits in zip(self.BUCKETS, buckets):
+          lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}}' + \
+              f' {hits}')
+        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {total}')
+        lines.append(f'{name}_count{{endpoint="{endpoint}"}} {count}')
+
+      for label, table in (("endpoint", self.request_db), \
+          ("method", self.method_db)):
+        prefix = f'data_barn_db_{label}'
+        for i, metric in enumerate(("queries_total", "seconds_total", \
+            "rows_total")):
+          lines.append(f'# TYPE {prefix}_{metric} counter')
+          for key, values in sorted(table.items()):
+            lines.append(f'{prefix}_{metric}{{{label}="{key}"}} {values[i]}')
+
+    with _method_calls_lock:
+      calls = sorted(_method_calls.items())
+    lines += ["# TYPE data_barn_db_method_calls_total counter"]
+    for name, count in calls:
+      lines.append(f'data_barn_db_method_calls_total{{method="{name}"}} ' + \
+          f'{count}')
+
+    for collect in self.extra:
+      lines += collect()
+
+    return "\n".join(lines) + "\n"
+
+  def _before_cursor(self, conn, cursor, statement, params, context, many):
+    conn.info.setdefault("data_barn_query_start", []) \
+        .append(time.perf_counter())
+
+  def _after_cursor(self, conn, cursor, statement, params, context, many):
+    elapsed = time.perf_counter() - conn.info["data_barn_query_start"].pop()
+    rows = max(cursor.rowcount, 0) if cursor is not None else 0
+
+    stats = _request_stats.get()
+    if stats is not None:
+      stats["queries"] += 1
+      stats["seconds"] += elapsed
+      stats["rows"] += rows
+      if len(stats["statements"]) < self.MAX_STATEMENTS:
+        stats["statements"].append((elapsed, statement))
+
+    methods = set(_method_stack.get())
+    if methods:
+      with self._lock:
+        for name in methods:
+          totals = self.method_db.setdefault(name, [0, 0.0, 0])
+          totals[0] += 1
+          totals[1] += elapsed
+          totals[2] += rows
+
+    if elapsed >= self.slow_query_seconds:
+      digest, normalized = fingerprint(statement)
+      slow_log.warning("slow query %.1fms [%s] %s", elapsed * 1000, digest, \
+          normalized)
+
+  def _cursor_error(self, context) -> None:
+    if context.connection is not None:
+      starts = context.connection.info.get("data_barn_query_start")
+      if starts:
+        starts.pop()
+
+  def _before_request(self) -> None:
+    g.data_barn_request_start = time.perf_counter()
+    _request_stats.set({"queries": 0, "seconds": 0.0, "rows": 0, \
+        "statements": []})
+
+  def _after_request(self, response):
+    start = g.pop("data_barn_request_start", None)
+    stats = _request_stats.get()
+    if start is None or stats is None:
+      return response
+    elapsed = time.perf_counter() - start
+    _request_stats.set(None)
+    endpoint = request.endpoint or "unmatched"
+
+    with self._lock:
+      key = (endpoint, request.method, response.status_code)
+      self.requests[key] = self.requests.get(key, 0) + 1
+      buckets, total, count = self.latency.get(endpoint, \
+          ([0] * len(self.BUCKETS), 0.0, 0))
+      buckets = [hits + (elapsed <= bound) for hits, bound in \
+          zip(buckets, self.BUCKETS)]
+      self.latency[endpoint] = (buckets, total + elapsed, count + 1)
+      totals = self.request_db.setdefault(endpoint, [0, 0.0, 0])
+      totals[0] += stats["queries"]
+      totals[1] += stats["seconds"]
+      totals[2] += stats["rows"]
+
+    if elapsed >= self.slow_request_seconds:
+      slowest = sorted(stats["statements"], key = lambda s: s[0], \
+          reverse = True)[:5]
+      slow_log.warning("slow request %s %.1fms, %d queries, %.1fms in db: %s", \
+          endpoint, elapsed * 1000, stats["queries"], stats["seconds"] * 1000, \
+          ", ".join(f'[{fingerprint(s)[0]}] {t * 1000:.1f}ms' \
+          for t, s in slowest))
+
+    return response
@@ -1,12 +1,12 @@
-import uuid
 from typing import Optional
-from sqlalchemy import String, Integer, Float, Boolean, Date 
-from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import String, Integer, Float, Boolean, Date, DateTime, Text
+from sqlalchemy import ForeignKey, UniqueConstraint, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from . import db
+from .ids import uuid7
 
 
 class User(UserMixin, db.Model):
@@ -16,7 +16,7 @@ class User(UserMixin, db.Model):
   '''
   __tablename__ = "user"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   name = db.Column(String(15), nullable = False, unique = True)
   password = db.Column(String(256), nullable = False)
   perms = db.Column(String(15), nullable = False, default = "guest")
@@ -51,13 +51,48 @@ class User(UserMixin, db.Model):
     return f'User(name = {self.name})'
 
 
+class WebSession(db.Model):
+  '''
+  Server-side session storage used by SQLSessionStore.  The session cookie
+  holds only the signed id; expires is indexed so expired sessions can be
+  deleted in batches.
+  '''
+  __tablename__ = "web_session"
+
+  id = db.Column(String(64), primary_key = True)
+  data = db.Column(Text, nullable = False)
+  expires = db.Column(DateTime(timezone = True), nullable = False, \
+      index = True)
+
+  def __repr__(self) -> str:
+    return f'WebSession(id = {self.id}, expires = {self.expires})'
+
+
+class DataLoad(db.Model):
+  '''
+  One row per DataLoader load.  The id only ever increases, so the latest id
+  is the data version that workers compare to know when cached statistics,
+  snapshots, and features are out of date, including after loads that edit
+  rows without adding races.
+  '''
+  __tablename__ = "data_load"
+
+  id = db.Column(Integer, primary_key = True, autoincrement = True)
+  loaded_at = db.Column(DateTime(timezone = True), nullable = False, \
+      server_default = func.now())
+  entries = db.Column(Integer, nullable = False, default = 0)
+
+  def __repr__(self) -> str:
+    return f'DataLoad(id = {self.id}, loaded_at = {self.loaded_at})'
+
+
 class Horse(db.Model):
   '''
   Implements horse table from thoroughbred_api database.
   '''
   __tablename__ = "horse"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   name = db.Column(String(30), nullable = False)
   sire_id = db.Column(UUID(as_uuid = True), ForeignKey("horse.id"))
   owner_id = db.Column(UUID(as_uuid = True), ForeignKey("owner.id"))
@@ -79,7 +114,7 @@ class Track(db.Model):
   '''
   __tablename__ = "track"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   abbreviation = db.Column(String(5), nullable = False)
   name = db.Column(String(50))
   location = db.Column(String(60))
@@ -94,7 +129,7 @@ class Race(db.Model):
   '''
   __tablename__ = "race"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   track_id = db.Column(UUID(as_uuid = True), ForeignKey("track.id"))
   type = db.Column(String(15), nullable = False)
   restriction = db.Column(String(15), nullable = False, default = "open")
@@ -117,7 +152,7 @@ class Running(db.Model):
   '''
   __tablename__ = "running"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   race_id = db.Column(UUID(as_uuid = True), ForeignKey("race.id"), \
       nullable = False)
   meet = db.Column(String(15))
@@ -134,11 +169,37 @@ class Running(db.Model):
   race = relationship("Race", back_populates = "was_run")
   winner = relationship("Horse", back_populates = "won")
   field = relationship("Entry", back_populates = "entered", uselist = True)
+  figure = relationship("Figure", back_populates = "running", uselist = False)
 
   def __repr__(self) -> str:
     return f'Running(race_id = {self.race_id}, date = {self.date})'
 
 
+class Figure(db.Model):
+  '''
+  Speed and pace figures for the winner of a running, computed in batch by
+  FigureBuilder from final and half mile times.  Par times and the daily
+  track variant used for each figure are stored alongside it.  Figures are
+  indexed so leaderboards are index scans.
+  '''
+  __tablename__ = "figure"
+
+  running_id = db.Column(UUID(as_uuid = True), ForeignKey("running.id"), \
+      primary_key = True)
+  par_seconds = db.Column(Float(6))
+  half_mile_par_seconds = db.Column(Float(6))
+  track_variant = db.Column(Float(6))
+  pace_variant = db.Column(Float(6))
+  speed_figure = db.Column(Integer, index = True)
+  pace_figure = db.Column(Integer, index = True)
+
+  running = relationship("Running", back_populates = "figure")
+
+  def __repr__(self) -> str:
+    return f'Figure(running_id = {self.running_id}, ' + \
+        f'speed_figure = {self.speed_figure})'
+
+
 class Entry(db.Model):
   '''
   Implements entry table from thoroughbred_api database.  Each record in the
@@ -192,7 +253,7 @@ class Owner(db.Model):
   '''
   __tablename__ = "owner"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   name = db.Column(String(256))
 
   stable = relationship("Horse", back_populates = "owner", uselist = True)
@@ -207,7 +268,7 @@ class Trainer(db.Model):
   '''
   __tablename__ = "trainer"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   first_name = db.Column(String(20))
   last_name = db.Column(String(30))
 
@@ -224,7 +285,7 @@ class Jockey(db.Model):
   '''
   __tablename__ = "jockey"
 
-  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid.uuid4)
+  id = db.Column(UUID(as_uuid = True), primary_key = True, default = uuid7)
   first_name = db.Column(String(20))
   last_name = db.Column(String(30))
 
@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event, func, make_url, select
+from sqlalchemy.orm import Session
+
+try:
+  import psycopg
+  from psycopg import sql
+except ImportError:
+  psycopg = None
+
+log = logging.getLogger("data_barn.notifications")
+
+class ChangeNotifier(object):
+  '''
+  Cross-worker cache invalidation over PostgreSQL LISTEN/NOTIFY.  Writers
+  publish which tables changed (and, after a load, the new data version) on
+  a channel; every worker runs a listener thread on its own connection and
+  calls the callbacks subscribed to those tables, so in-process caches are
+  refreshed as soon as another process commits instead of when they
+  expire.  A notification published inside a transaction is only delivered
+  if it commits.
+
+  Callbacks also run in the publishing process, right away or, for a
+  change published from a session's flush, once that session commits (and
+  again when its own notification arrives, so they must be idempotent).  A
+  rollback discards them, so a cache is never refreshed from a change that
+  did not happen, nor refilled with the old row before the commit.  That is
+  the only delivery on other databases (eg. SQLite in development), where
+  there is nothing to listen to.  Each time the listener connects, every
+  callback is called with tables None, since changes may have been missed.
+
+  Enabled by CHANGE_NOTIFICATIONS on a PostgreSQL database with psycopg
+  installed.
+
+  Attributes:
+    DATA_TABLES: tuple[str]
+      Racing tables written by DataLoader.
+
+    PENDING: str
+      Session.info key of the payloads waiting for the session to commit.
+
+    enabled: bool
+      Whether notifications are sent and listened for.
+
+    channel: str
+      NOTIFY channel (CHANGE_CHANNEL).
+
+    retry: float
+      Seconds between listener reconnect attempts (CHANGE_RECONNECT).
+
+    connected: bool
+      Whether this worker's listener is connected.
+
+    received: int
+      Notifications received by this worker.
+
+  Methods:
+    init_app(app):
+      Reads the config and starts the listener before the first request
+      in each worker process.
+
+    subscribe(tables, callback):
+      Calls callback(payload) when any of tables changes, or on any change
+      if tables is None.
+
+    publish(tables, version, ids, connection, session):
+      Notifies every worker that tables changed.
+
+    stats():
+      Listener state and notifications received.
+
+    _listen():
+      Listener thread: LISTEN on the channel and dispatch notifications,
+      reconnecting after errors.
+
+    _dispatch(payload):
+      Calls the callbacks subscribed to the tables in payload.
+
+    _committed(session), _rolled_back(session):
+      Session events dispatching or discarding its pending payloads.
+  '''
+  DATA_TABLES = ("running", "entry", "race", "horse", "jockey", "trainer", \
+      "owner", "track", "figure")
+  PENDING = "data_barn.changes"
+
+  def __init__(self) -> None:
+    self.enabled = False
+    self.channel = "data_barn_changes"
+    self.retry = 5.0
+    self.connected = False
+    self.received = 0
+    self._dsn = None
+    self._subscribers = []
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    self.enabled = app.config.get("CHANGE_NOTIFICATIONS", True) and \
+        url.get_backend_name() == "postgresql" and psycopg is not None
+    self.channel = app.config.get("CHANGE_CHANNEL", self.channel)
+    self.retry = app.config.get("CHANGE_RECONNECT", self.retry)
+    self._dsn = url.set(drivername = "postgresql") \
+        .render_as_string(hide_password = False)
+    if self.enabled:
+      app.before_request(self._start)
+    if not event.contains(Session, "after_commit", self._committed):
+      event.listen(Session, "after_commit", self._committed)
+      event.listen(Session, "after_rollback", self._rolled_back)
+
+  def subscribe(self, tables, callback) -> None:
+    entry = (None if tables is None else frozenset(tables), callback)
+    with self._lock:
+      if entry not in self._subscribers:
+        self._subscribers.append(entry)
+
+  def publish(self, tables, version: int | None = None, \
+      ids: list[str] | None = None, connection = None, \
+      session: Session | None = None) -> None:
+    '''
+    Notifies every worker that tables changed, and runs this process's
+    callbacks.
+
+    Parameters:
+      tables: list[str]
+        Names of the tables written.
+      version: int | None
+        New data version, for DBHandler, when known.
+      ids: list[str] | None
+        Hex primary keys of the rows changed, when only a few were.
+      connection: sqlalchemy.engine.Connection | None
+        Connection of the transaction that made the change, so the
+        notification is sent when it commits.  Without one, it is sent
+        at once on a connection of its own, leaving db.session alone.
+      session: sqlalchemy.orm.Session | None
+        Session flushing the change, when published from a flush event, so
+        this process's callbacks run after it commits instead of mid-flush.
+    '''
+    payload = {"tables": list(tables), "version": version, "ids": ids}
+    if self.enabled:
+      stmt = select(func.pg_notify(self.channel, json.dumps(payload)))
+      if connection is not None:
+        connection.execute(stmt)
+      else:
+        from . import db
+        with db.engine.begin() as conn:
+          conn.execute(stmt)
+    if session is not None:
+      session.info.setdefault(self.PENDING, []).append(payload)
+    else:
+      self._dispatch(payload)
+
+  def stats(self) -> dict[str, int]:
+    return {"connected": int(self.connected), "received": self.received}
+
+  def _start(self) -> None:
+    if self._pid == os.getpid():
+      return
+    with self._lock:
+      if self._pid != os.getpid():
+        self._pid = os.getpid()
+        self.connected = False
+        threading.Thread(target = self._listen, \
+            name = "data_barn-notifications", daemon = True).start()
+
+  def _listen(self) -> None:
+    while True:
+      try:
+        with psycopg.connect(self._dsn, autocommit = True) as conn:
+          conn.execute(sql.SQL("LISTEN {}").format( \
+              sql.Identifier(self.channel)))
+          self.connected = True
+          # Anything may have changed before LISTEN took effect.
+          self._dispatch({"tables": None, "version": None, "ids": None})
+          for notify in conn.notifies():
+            self.received += 1
+            try:
+              payload = json.loads(notify.payload)
+            except ValueError:
+              log.warning("ignoring notification %r", notify.payload)
+              continue
+            self._dispatch(payload)
+      except psycopg.Error as e:
+        log.warning("change listener disconnected: %s", e)
+      self.connected = False
+      time.sleep(self.retry)
+
+  def _committed(self, session: Session) -> None:
+    for payload in session.info.pop(self.PENDING, []):
+      self._dispatch(payload)
+
+  def _rolled_back(self, session: Session) -> None:
+    session.info.pop(self.PENDING, None)
+
+  def _dispatch(self, payload: dict) -> None:
+    tables = payload.get("tables")
+    with self._lock:
+      subscribers = list(self._subscribers)
+    for subscribed, callback in subscribers:
+      if tables is None or subscribed is None or subscribed & set(tables):
+        try:
+          callback(payload)
+        except Exception:
+          log.exception("change callback %r failed", callback)
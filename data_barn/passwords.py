@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class HasherBusy(Exception):
+  '''
+  Raised when the password hashing queue is full or a hash does not finish
+  within the configured timeout.
+  '''
+
+
+class PasswordHasher(object):
+  '''
+  Runs password hashing and verification on a bounded thread pool so a burst
+  of logins cannot tie up every request thread with CPU-bound key
+  derivation.  hashlib's scrypt and pbkdf2 release the GIL, so the pool size
+  is the number of hashes that run at once; at most queue_size more wait
+  behind them and anything beyond that is rejected with HasherBusy.
+
+  Attributes:
+    method: str
+      Werkzeug hash method and cost parameters for new hashes, eg.
+      "scrypt:32768:8:1".  Existing hashes are verified with the
+      parameters they were created with.
+
+    timeout: float
+      Seconds to wait for a result once a hash is queued.  A full queue
+      is rejected at once rather than waited on.
+
+  Methods:
+    init_app(app):
+      Reads the PASSWORD_HASH_* settings from the app config.
+
+    hash(password):
+      Hashes a new password with self.method.
+
+    verify(pwhash, password):
+      Checks a password against a stored hash.
+
+    shutdown():
+      Stops the worker threads.
+
+    _run(func, *args, **kwargs):
+      Submits work to the pool if there is room and waits for the result.
+  '''
+  def __init__(self, workers: int = 4, queue_size: int = 32, \
+      method: str = "scrypt:32768:8:1", timeout: float = 10.0) -> None:
+    self.method = method
+    self.timeout = timeout
+    self._slots = threading.BoundedSemaphore(workers + queue_size)
+    # Threads are started on first submit, so a pool created before a
+    # prefork server forks its workers has no threads to lose.
+    self._executor = ThreadPoolExecutor(max_workers = workers, \
+        thread_name_prefix = "password-hasher")
+
+  def init_app(self, app) -> None:
+    workers = app.config.get("PASSWORD_HASH_WORKERS", 4)
+    queue_size = app.config.get("PASSWORD_HASH_QUEUE", 32)
+    self.method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+    self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", self.timeout)
+    self._executor.shutdown(wait = False)
+    self._slots = threading.BoundedSemaphore(workers + queue_size)
+    self._executor = ThreadPoolExecutor(max_workers = workers, \
+        thread_name_prefix = "password-hasher")
+
+  def hash(self, password: str) -> str:
+    return self._run(generate_password_hash, password, method = self.method)
+
+  def verify(self, pwhash: str, password: str) -> bool:
+    return self._run(check_password_hash, pwhash, password)
+
+  def shutdown(self) -> None:
+    self._executor.shutdown(wait = False, cancel_futures = True)
+
+  def _run(self, func, *args, **kwargs):
+    # A request thread never waits for room in the queue; callers turn
+    # HasherBusy into a 503 straight away.
+    if not self._slots.acquire(blocking = False):
+      raise HasherBusy("Password hashing queue is full")
+    try:
+      future = self._executor.submit(func, *args, **kwargs)
+    except RuntimeError:
+      self._slots.release()
+      raise
+    future.add_done_callback(lambda _: self._slots.release())
+
+    try:
+      return future.result(timeout = self.timeout)
+    except TimeoutError as err:
+      future.cancel()
+      raise HasherBusy("Password hashing timed out") from err
+
+
+class LoginThrottle(object):
+  '''
+  Sliding window limit on failed log in attempts, checked before any
+  password hashing is done.  Failures are counted separately per key (eg.
+  "user:<name>" and "ip:<address>") and each kind of key can have its own
+  limit.
+
+  Failures are counted in memory in each worker process, so across the
+  deployment a key can fail up to its limit times WEB_WORKERS before every
+  worker refuses it.  Client addresses come from request.remote_addr,
+  which behind a reverse proxy is the proxy's address unless
+  TRUSTED_PROXIES is set so create_app() applies ProxyFix.
+
+  Attributes:
+    window: float
+      Length of the sliding window in seconds.
+
+    limits: dict[str, int]
+      Maximum failures within the window for each key prefix.
+
+    max_keys: int
+      Number of tracked keys above which every key is pruned, so the
+      table cannot grow without bound.
+
+  Methods:
+    init_app(app):
+      Reads the LOGIN_* settings from the app config.
+
+    retry_after(keys):
+      Seconds until another attempt is allowed for any of keys, or 0.
+
+    record_failure(keys):
+      Counts a failed attempt against each key.
+
+    reset(key):
+      Clears failures for a key after a successful log in.
+
+    _prune(key, now):
+      Drops failures older than the window for a key.
+  '''
+  def __init__(self, limits: dict[str, int] | None = None, \
+      window: float = 300.0, \
+      max_keys: int = 10000) -> None:
+    self.window = window
+    self.limits = limits or {}
+    self.max_keys = max_keys
+    self._failures = {}
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    self.limits = {"user": app.config.get("LOGIN_MAX_FAILURES_PER_USER", 5), \
+        "ip": app.config.get("LOGIN_MAX_FAILURES_PER_IP", 20)}
+    self.window = app.config.get("LOGIN_FAILURE_WINDOW", self.window)
+
+  def retry_after(self, keys: list[str]) -> float:
+    now = time.monotonic()
+    wait = 0.0
+    with self._lock:
+      for key in keys:
+        failures = self._prune(key, now)
+        limit = self.limits.get(key.split(":", 1)[0])
+        if limit and failures and len(failures) >= limit:
+          wait = max(wait, failures[0] + self.window - now)
+
+    return wait
+
+  def record_failure(self, keys: list[str]) -> None:
+    now = time.monotonic()
+    with self._lock:
+      for key in keys:
+        self._failures.setdefault(key, deque()).append(now)
+        self._prune(key, now)
+      if len(self._failures) > self.max_keys:
+        for key in list(self._failures):
+          self._prune(key, now)
+
+  def reset(self, key: str) -> None:
+    with self._lock:
+      self._failures.pop(key, None)
+
+  def _prune(self, key: str, now: float) -> deque | None:
+    failures = self._failures.get(key)
+    if failures is None:
+      return None
+    while failures and failures[0] <= now - self.window:
+      failures.popleft()
+    if not failures:
+      del self._failures[key]
+      return None
+    limit = self.limits.get(key.split(":", 1)[0])
+    while limit and len(failures) > limit:
+      failures.popleft()
+
+    return failures
@@ -0,0 +1,178 @@
+import cProfile
+import functools
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from flask_login import current_user
+
+class _StackSampler(object):
+  '''
+  Samples the call stack of one thread from a background thread and counts
+  each distinct stack, written out as collapsed stacks (one "a;b;c count"
+  line per stack) for flame graph tools.
+  '''
+  def __init__(self, interval: float) -> None:
+    self.interval = interval
+    self.counts = Counter()
+    self._target = threading.get_ident()
+    self._done = threading.Event()
+    self._thread = threading.Thread(target = self._run, daemon = True, \
+        name = "data-barn-sampler")
+
+  def start(self) -> None:
+    self._thread.start()
+
+  def stop(self, path: str) -> None:
+    self._done.set()
+    self._thread.join()
+    with open(path, "w") as out:
+      for stack, count in self.counts.most_common():
+        out.write(f'{stack} {count}\n')
+
+  def _run(self) -> None:
+    while not self._done.wait(self.interval):
+      frame = sys._current_frames().get(self._target)
+      stack = []
+      while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ' + \
+            f'({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+      if stack:
+        self.counts[";".join(reversed(stack))] += 1
+
+
+class _CProfileSession(object):
+  '''
+  Deterministic profile of the current thread, written as pstats.
+  '''
+  def __init__(self) -> None:
+    self._profile = cProfile.Profile()
+
+  def start(self) -> None:
+    self._profile.enable()
+
+  def stop(self, path: str) -> None:
+    self._profile.disable()
+    self._profile.dump_stats(path)
+
+
+class Profiler(object):
+  '''
+  Opt-in profiling of requests and long-running jobs.  When PROFILING_ENABLED
+  is False (the default) no request hooks are registered and profile_job
+  only checks a flag, so there is no overhead.  When enabled, a request is
+  profiled if an admin sends the PROFILE_HEADER header or the "profile"
+  query flag, or at random with probability PROFILE_SAMPLE_RATE.  The
+  profile covers the view, DBHandler calls, and template rendering, and is
+  written to PROFILE_DIR.
+
+  PROFILE_FORMAT selects the output: "pstats" (cProfile, open with pstats
+  or snakeviz) or "collapsed" (stack samples every PROFILE_INTERVAL
+  seconds, for flamegraph.pl or speedscope).
+
+  Attributes:
+    enabled: bool
+    directory: str
+    sample_rate: float
+    output: str
+    interval: float
+    header: str
+
+  Methods:
+    init_app(app):
+      Reads PROFILE_* settings and registers request hooks if enabled.
+
+    profile_job(func):
+      Decorator that profiles a whole call, eg. DataLoader.batch_process.
+
+    session(name):
+      Starts a profile and returns a callable that stops and writes it.
+
+    _start_request():
+    _stop_request(exc):
+      Flask request hooks.
+
+    _wanted():
+      Whether the current request should be profiled.
+  '''
+  def __init__(self) -> None:
+    self.enabled = False
+    self.directory = "profiles"
+    self.sample_rate = 0.0
+    self.output = "pstats"
+    self.interval = 0.001
+    self.header = "X-Profile"
+    self._counter = itertools.count()
+
+  def init_app(self, app) -> None:
+    self.enabled = app.config.get("PROFILING_ENABLED", False)
+    self.directory = app.config.get("PROFILE_DIR", self.directory)
+    self.sample_rate = app.config.get("PROFILE_SAMPLE_RATE", self.sample_rate)
+    self.output = app.config.get("PROFILE_FORMAT", self.output)
+    self.interval = app.config.get("PROFILE_INTERVAL", self.interval)
+    self.header = app.config.get("PROFILE_HEADER", self.header)
+    if self.enabled:
+      app.before_request(self._start_request)
+      app.teardown_request(self._stop_request)
+
+  def profile_job(self, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if not self.enabled:
+        return func(*args, **kwargs)
+      stop = self.session(func.__qualname__)
+      try:
+        return func(*args, **kwargs)
+      finally:
+        stop()
+
+    return wrapper
+
+  def session(self, name: str):
+    '''
+    Starts profiling the current thread.
+
+    Parameters:
+      name: str
+        Used in the output file name.
+
+    Returns: callable
+      Stops the profile, writes it, and returns the file path.
+    '''
+    if self.output == "collapsed":
+      profile, ext = _StackSampler(self.interval), "collapsed"
+    else:
+      profile, ext = _CProfileSession(), "pstats"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(self.directory, f'{name.replace("/", ".")}-' + \
+        f'{stamp}-{os.getpid()}-{next(self._counter)}.{ext}')
+    profile.start()
+
+    def stop() -> str:
+      os.makedirs(self.directory, exist_ok = True)
+      profile.stop(path)
+      return path
+
+    return stop
+
+  def _start_request(self) -> None:
+    if self._wanted():
+      g.data_barn_profile = self.session(request.endpoint or "unmatched")
+
+  def _stop_request(self, exc) -> None:
+    stop = g.pop("data_barn_profile", None)
+    if stop is not None:
+      stop()
+
+  def _wanted(self) -> bool:
+    if request.headers.get(self.header) or "profile" in request.args:
+      return current_user.is_authenticated and \
+          getattr(current_user, "perms", None) == "admin"
+
+    return self.sample_rate > 0 and random.random() < self.sample_rate
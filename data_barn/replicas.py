@@ -0,0 +1,118 @@
+import itertools
+import logging
+import threading
+import time
+from sqlalchemy import exc
+
+log = logging.getLogger("data_barn.replicas")
+
+class ReplicaRouter(object):
+  '''
+  Sends read-only analytics statements to read replicas.  Each URI in
+  DB_REPLICA_URIS becomes a Flask-SQLAlchemy bind ("replica_0",
+  "replica_1", ...) so it shares the pool settings, metrics, and fork
+  handling of the primary engine.  Statements go to the replicas in turn;
+  a replica that cannot be reached is skipped for DB_REPLICA_RETRY seconds
+  and the statement is retried on the next one, falling back to the primary
+  when none are available.  With no replicas configured every statement
+  runs on the primary through db.session, exactly as before.
+
+  Only DBHandler reads are routed here.  Logins, registration, and the
+  DataLoader read and write through db.session on the primary, so they
+  always see their own writes.
+
+  Attributes:
+    binds: list[str]
+      Bind keys of the configured replicas.
+
+    retry: float
+      Seconds a failed replica is left out of the rotation.
+
+  Methods:
+    init_app(app):
+      Adds a bind for each replica.  Must run before db.init_app(app).
+
+    execute(stmt):
+      Runs a select on a healthy replica, or the primary, and returns all
+      rows.
+
+    stats():
+      Statements run and failures per replica, and which are down.
+
+    _mark_down(key, error):
+      Takes a replica out of the rotation for retry seconds.
+
+    _next_engines():
+      Replica engines to try, in round-robin order, skipping those down.
+  '''
+  def __init__(self, db) -> None:
+    self.db = db
+    self.binds = []
+    self.retry = 30.0
+    self._down_until = {}
+    self._counts = {}
+    self._turn = itertools.count()
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    uris = app.config.get("DB_REPLICA_URIS") or []
+    self.retry = app.config.get("DB_REPLICA_RETRY", self.retry)
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    self.binds = []
+    for i, uri in enumerate(uris):
+      binds[f'replica_{i}'] = uri
+      self.binds.append(f'replica_{i}')
+    app.config["SQLALCHEMY_BINDS"] = binds
+    with self._lock:
+      self._down_until = {}
+      self._counts = {key: [0, 0] for key in ["primary"] + self.binds}
+
+  def execute(self, stmt) -> list:
+    for key in self._next_engines():
+      try:
+        conn = self.db.engines[key].connect()
+      except exc.DBAPIError as e:
+        self._mark_down(key, e)
+        continue
+      try:
+        with conn:
+          rows = conn.execute(stmt).fetchall()
+      except exc.DBAPIError as e:
+        # Errors in the statement itself would fail on every database.
+        if not e.connection_invalidated:
+          raise
+        self._mark_down(key, e)
+        continue
+      with self._lock:
+        self._counts[key][0] += 1
+
+      return rows
+
+    rows = self.db.session.execute(stmt).fetchall()
+    with self._lock:
+      self._counts["primary"][0] += 1
+
+    return rows
+
+  def stats(self) -> dict[str, dict]:
+    now = time.monotonic()
+    with self._lock:
+      return {key: {"statements": counts[0], "failures": counts[1], \
+          "up": self._down_until.get(key, 0) <= now} \
+          for key, counts in self._counts.items()}
+
+  def _mark_down(self, key: str, error) -> None:
+    log.warning("replica %s unavailable, skipping for %.0fs: %s", key, \
+        self.retry, error.orig if error.orig is not None else error)
+    with self._lock:
+      self._down_until[key] = time.monotonic() + self.retry
+      self._counts[key][1] += 1
+
+  def _next_engines(self) -> list[str]:
+    if not self.binds:
+      return []
+    now = time.monotonic()
+    start = next(self._turn) % len(self.binds)
+    order = self.binds[start:] + self.binds[:start]
+    with self._lock:
+      return [key for key in order if self._down_until.get(key, 0) <= now]
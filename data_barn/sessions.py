@@ -0,0 +1,316 @@
+import heapq
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from flask import request
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import delete, insert, update
+from werkzeug.datastructures import CallbackDict
+
+class ServerSession(CallbackDict, SessionMixin):
+  '''
+  Session whose contents live in a SessionStore.  The cookie only carries a
+  signed session id.
+
+  Attributes:
+    sid: str
+      Session id, also the key in the store.
+
+    new: bool
+      True if the session did not exist in the store before this request.
+
+    expires: datetime | None
+      When the stored copy expires, used to decide when to refresh it.
+
+    replaces: str | None
+      Stored session id given up by regenerate(), deleted from the store
+      when the session is saved.
+
+    accessed: bool
+      True once the session has been read or written, so only responses
+      that depend on it vary on the cookie.
+
+  Methods:
+    regenerate():
+      Moves the session to a new id.
+  '''
+  def __init__(self, initial = None, sid: str = "", new: bool = False, \
+      expires: datetime | None = None) -> None:
+    def on_update(session):
+      session.modified = True
+      session.accessed = True
+    super().__init__(initial, on_update)
+    self.sid = sid
+    self.new = new
+    self.expires = expires
+    self.modified = False
+    self.accessed = False
+    self.replaces = None
+
+  def __getitem__(self, key):
+    self.accessed = True
+
+    return super().__getitem__(key)
+
+  def get(self, key, default = None):
+    self.accessed = True
+
+    return super().get(key, default)
+
+  def setdefault(self, key, default = None):
+    self.accessed = True
+
+    return super().setdefault(key, default)
+
+  def regenerate(self) -> None:
+    '''
+    Gives the session a new random id, keeping its contents, so an id
+    known before a log in or log out (eg. one planted in the browser by an
+    attacker) is worthless afterwards.  Called whenever the user changes.
+    '''
+    if self.replaces is None and not self.new:
+      self.replaces = self.sid
+    self.sid = secrets.token_urlsafe(32)
+    self.modified = True
+    self.accessed = True
+
+
+class MemorySessionStore(object):
+  '''
+  Session storage in a dict for a single process.  Expiry times are also
+  kept in a heap so sweep() only looks at entries that are due, rather than
+  every stored session.
+
+  Methods:
+    load(sid, now):
+      Returns (data, expires) for a live session or None.
+
+    save(sid, data, expires):
+      Stores serialized session data.
+
+    delete(sid):
+      Removes a session.
+
+    sweep(now, batch_size):
+      Removes up to batch_size expired sessions and returns the number
+      removed.
+  '''
+  def __init__(self) -> None:
+    self._sessions = {}
+    self._expiry = []
+    self._lock = threading.Lock()
+
+  def load(self, sid: str, now: datetime) -> tuple[str, datetime] | None:
+    with self._lock:
+      stored = self._sessions.get(sid)
+    if stored is None or stored[1] <= now:
+      return None
+
+    return stored
+
+  def save(self, sid: str, data: str, expires: datetime) -> None:
+    with self._lock:
+      self._sessions[sid] = (data, expires)
+      heapq.heappush(self._expiry, (expires, sid))
+
+  def delete(self, sid: str) -> None:
+    with self._lock:
+      self._sessions.pop(sid, None)
+
+  def sweep(self, now: datetime, batch_size: int = 1000) -> int:
+    removed = 0
+    with self._lock:
+      while self._expiry and self._expiry[0][0] <= now and \
+          removed < batch_size:
+        expires, sid = heapq.heappop(self._expiry)
+        stored = self._sessions.get(sid)
+        # Sessions saved again since this heap entry have a later expiry.
+        if stored is not None and stored[1] == expires:
+          del self._sessions[sid]
+          removed += 1
+
+    return removed
+
+
+class SQLSessionStore(object):
+  '''
+  Session storage in the web_session table, shared by every worker and
+  process using the database.  Each operation runs on its own connection
+  and transaction so session writes never commit a view's db.session.
+  Expired rows are deleted in batches using the index on expires.
+
+  Methods:
+    Same as MemorySessionStore.
+  '''
+  def __init__(self, db) -> None:
+    from .models import WebSession
+    self.db = db
+    self.table = WebSession.__table__
+
+  def load(self, sid: str, now: datetime) -> tuple[str, datetime] | None:
+    stmt = self.db.select(self.table.c.data, self.table.c.expires) \
+        .where(self.table.c.id == sid, self.table.c.expires > now)
+    with self.db.engine.connect() as conn:
+      row = conn.execute(stmt).first()
+    if row is None:
+      return None
+    expires = row.expires
+    if expires.tzinfo is None:
+      expires = expires.replace(tzinfo = timezone.utc)
+
+    return row.data, expires
+
+  def save(self, sid: str, data: str, expires: datetime) -> None:
+    with self.db.engine.begin() as conn:
+      updated = conn.execute(update(self.table) \
+          .where(self.table.c.id == sid) \
+          .values(data = data, expires = expires))
+      if updated.rowcount == 0:
+        conn.execute(insert(self.table) \
+            .values(id = sid, data = data, expires = expires))
+
+  def delete(self, sid: str) -> None:
+    with self.db.engine.begin() as conn:
+      conn.execute(delete(self.table).where(self.table.c.id == sid))
+
+  def sweep(self, now: datetime, batch_size: int = 1000) -> int:
+    due = self.db.select(self.table.c.id) \
+        .where(self.table.c.expires <= now) \
+        .order_by(self.table.c.expires).limit(batch_size)
+    with self.db.engine.begin() as conn:
+      result = conn.execute(delete(self.table) \
+          .where(self.table.c.id.in_(due.scalar_subquery())))
+
+    return result.rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+  '''
+  Flask session interface backed by a MemorySessionStore or SQLSessionStore.
+  The store is read once per request that sends a session cookie, except
+  for static and fingerprinted asset files, which never use the session,
+  and only written when the session changes, or when more than half of its lifetime
+  has passed so active users are not logged out.  Every sweep_interval
+  seconds one request also sweeps a batch of expired sessions.
+
+  Attributes:
+    SKIP_PATHS: tuple[str]
+      URL prefixes, besides the static folder's, given an empty session
+      without reading the store, whose responses neither vary on the
+      cookie nor save the session unless a view changes it.
+
+    store: MemorySessionStore | SQLSessionStore
+      Where session data is kept.
+
+    sweep_interval: float
+      Minimum seconds between expiry sweeps.
+
+    sweep_batch: int
+      Maximum number of expired sessions removed per sweep statement.
+
+  Methods:
+    open_session(app, request):
+      Loads the session named by the signed cookie or starts a new one.
+
+    save_session(app, session, response):
+      Writes a changed session to the store and sets the cookie, and
+      deletes the id it replaced after regenerate().
+
+    _maybe_sweep(now):
+      Runs store.sweep() if sweep_interval has passed.
+
+    _skipped(app, request):
+      Whether the request is for a static or asset file.
+  '''
+  serializer = TaggedJSONSerializer()
+  session_class = ServerSession
+  SKIP_PATHS = ("/assets/",)
+
+  def __init__(self, store, sweep_interval: float = 300.0, \
+      sweep_batch: int = 1000) -> None:
+    self.store = store
+    self.sweep_interval = sweep_interval
+    self.sweep_batch = sweep_batch
+    self._next_sweep = time.monotonic() + sweep_interval
+    self._sweep_lock = threading.Lock()
+
+  def open_session(self, app, request) -> ServerSession | None:
+    if not app.secret_key:
+      return None
+    signer = Signer(app.secret_key, salt = "data-barn-session")
+    cookie = request.cookies.get(self.get_cookie_name(app))
+    if cookie and not self._skipped(app, request):
+      try:
+        sid = signer.unsign(cookie).decode()
+      except BadSignature:
+        sid = None
+      if sid:
+        stored = self.store.load(sid, datetime.now(timezone.utc))
+        if stored is not None:
+          return self.session_class(self.serializer.loads(stored[0]), \
+              sid = sid, expires = stored[1])
+
+    return self.session_class(sid = secrets.token_urlsafe(32), new = True)
+
+  def save_session(self, app, session: ServerSession, response) -> None:
+    name = self.get_cookie_name(app)
+    domain = self.get_cookie_domain(app)
+    path = self.get_cookie_path(app)
+    now = datetime.now(timezone.utc)
+    # Flask marks any session accessed once extensions (eg. Flask-Login's
+    # remember cookie check) look at it after every request.
+    if not session.modified and self._skipped(app, request):
+      return
+    self._maybe_sweep(now)
+
+    if session.replaces is not None:
+      self.store.delete(session.replaces)
+      session.replaces = None
+
+    if session.accessed:
+      response.vary.add("Cookie")
+
+    if not session:
+      if session.modified and not session.new:
+        self.store.delete(session.sid)
+        response.delete_cookie(name, domain = domain, path = path)
+        response.vary.add("Cookie")
+      return
+
+    lifetime = app.permanent_session_lifetime
+    stale = session.expires is None or \
+        session.expires - now < lifetime / 2
+    if not (session.modified or session.new or stale):
+      return
+
+    expires = now + lifetime
+    self.store.save(session.sid, self.serializer.dumps(dict(session)), \
+        expires)
+    signer = Signer(app.secret_key, salt = "data-barn-session")
+    response.set_cookie(name, signer.sign(session.sid).decode(), \
+        expires = self.get_expiration_time(app, session), \
+        httponly = self.get_cookie_httponly(app), domain = domain, \
+        path = path, secure = self.get_cookie_secure(app), \
+        samesite = self.get_cookie_samesite(app))
+    response.vary.add("Cookie")
+
+  def _skipped(self, app, request) -> bool:
+    # Sessions are opened before the URL is matched, so go by path.
+    static = f'{app.static_url_path}/' if app.static_url_path else None
+
+    return request.path.startswith(self.SKIP_PATHS) or \
+        (static is not None and request.path.startswith(static))
+
+  def _maybe_sweep(self, now: datetime) -> None:
+    clock = time.monotonic()
+    if clock < self._next_sweep or not self._sweep_lock.acquire(False):
+      return
+    try:
+      self._next_sweep = clock + self.sweep_interval
+      while self.store.sweep(now, self.sweep_batch) >= self.sweep_batch:
+        pass
+    finally:
+      self._sweep_lock.release()
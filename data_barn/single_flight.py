@@ -0,0 +1,99 @@
+import threading
+
+class FlightTimeout(Exception):
+  '''
+  Raised when a request waiting on another request's computation gives up
+  after the configured timeout.
+  '''
+
+
+class _Flight(object):
+  def __init__(self) -> None:
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight(object):
+  '''
+  Coalesces concurrent identical computations within a worker.  The first
+  caller for a key runs the function; callers arriving while it is running
+  wait for it and receive the same result, or have the same exception
+  raised, rather than repeating the work.  Nothing is kept once the
+  computation finishes, so this only collapses a burst of simultaneous
+  requests and never serves stale results.  Keys should include a data
+  version so requests made after a load never join a computation started
+  before it.
+
+  Attributes:
+    timeout: float
+      Seconds a waiting caller waits before raising FlightTimeout.  The
+      computation itself is not interrupted.
+
+    leaders, followers, timeouts, errors: int
+      Counters reported by stats().
+
+  Methods:
+    init_app(app):
+      Reads AGGREGATE_WAIT_TIMEOUT from the app config.
+
+    do(key, func, *args, **kwargs):
+      Returns func(*args, **kwargs), sharing one call among concurrent
+      callers with the same key.
+
+    stats():
+      Snapshot of the counters and the number of computations in flight.
+  '''
+  def __init__(self, timeout: float = 30.0) -> None:
+    self.timeout = timeout
+    self.leaders = 0
+    self.followers = 0
+    self.timeouts = 0
+    self.errors = 0
+    self._flights = {}
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    self.timeout = app.config.get("AGGREGATE_WAIT_TIMEOUT", self.timeout)
+
+  def do(self, key, func, *args, **kwargs):
+    with self._lock:
+      flight = self._flights.get(key)
+      if flight is None:
+        flight = self._flights[key] = _Flight()
+        self.leaders += 1
+        leader = True
+      else:
+        self.followers += 1
+        leader = False
+
+    if not leader:
+      if not flight.done.wait(self.timeout):
+        with self._lock:
+          self.timeouts += 1
+        raise FlightTimeout(f'gave up waiting on {key!r} after ' + \
+            f'{self.timeout}s')
+      if flight.error is not None:
+        raise flight.error
+
+      return flight.result
+
+    try:
+      flight.result = func(*args, **kwargs)
+    except BaseException as e:
+      flight.error = e
+      with self._lock:
+        self.errors += 1
+      raise
+    finally:
+      with self._lock:
+        del self._flights[key]
+      flight.done.set()
+
+    return flight.result
+
+  def stats(self) -> dict[str, int]:
+    with self._lock:
+      return {"leaders": self.leaders, "followers": self.followers, \
+          "timeouts": self.timeouts, "errors": self.errors, \
+          "in_flight": len(self._flights)}
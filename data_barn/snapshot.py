@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import struct
+import threading
+import uuid
+import zlib
+from .files import FileStamp
+
+log = logging.getLogger("data_barn.snapshot")
+
+class AggregateSnapshot(object):
+  '''
+  On-disk copy of DBHandler.all_aggregate_wins for every measure and the
+  race count, written after each load so a new worker can serve aggregate
+  pages without running the aggregate queries.  The file is a fixed header
+  (magic, format, data version, payload length, CRC32) followed by a JSON
+  payload, which reads the same under any Python version.  Rows are stored
+  as dicts with UUIDs as strings, which templates read the same way as
+  result rows, and dicts keyed by win counts as lists of pairs.
+
+  A loaded snapshot is only served while its data version (the latest
+  data_load id) matches DBHandler.data_version(); otherwise aggregates are
+  queried live.
+
+  Attributes:
+    MAGIC: bytes
+    HEADER: struct.Struct
+      Magic, format, data version, payload length, and payload CRC32.
+
+    FORMAT: int
+      Bumped when the payload layout changes; files with another format
+      are ignored.
+
+    MEASURES: tuple[str]
+      Measures stored, as named in the dashboard URLs.
+
+    path: str
+      Snapshot file, SNAPSHOT_PATH or aggregates.snap in the instance
+      folder.
+
+    version: int | None
+      Data version of the loaded snapshot.
+
+  Methods:
+    init_app(app):
+      Sets the path, loads the snapshot if present, and adds the
+      "flask write-snapshot" command.
+
+    aggregates(measure, version):
+      Snapshot aggregates for "sires", "jockeys", or "trainers" if the
+      snapshot matches version, else None.
+
+    total(version):
+      Snapshot race count if the snapshot matches version, else None.
+
+    load():
+      Reads the snapshot file, reloading it if it has been replaced.
+
+    write():
+      Computes every aggregate live on the primary and writes a new
+      snapshot.
+
+    _plain(value):
+      Converts result rows and win count keys to JSON-able values.
+
+    _unpair(obj):
+      JSON object hook restoring the dicts _plain() stored as pairs.
+  '''
+  MAGIC = b"DBARNSNP"
+  FORMAT = 2
+  HEADER = struct.Struct("<8sHqQI")
+  MEASURES = ("sires", "jockeys", "trainers")
+
+  def __init__(self) -> None:
+    self.path = ""
+    self.version = None
+    self._data = None
+    self._file = FileStamp()
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    self.path = app.config.get("SNAPSHOT_PATH") or \
+        os.path.join(app.instance_path, "aggregates.snap")
+    self.version = None
+    self._data = None
+    self._file.reset(self.path)
+    self.load()
+
+    @app.cli.command("write-snapshot")
+    def write_snapshot_command():
+      '''Write the aggregate snapshot from the current data.'''
+      print(f'Wrote snapshot version {self.write()} to {self.path}')
+
+  def aggregates(self, measure: str, version: int) -> dict | None:
+    data = self._current(version)
+
+    return data["aggregates"][measure] if data is not None else None
+
+  def total(self, version: int) -> int | None:
+    data = self._current(version)
+
+    return data["total"] if data is not None else None
+
+  def load(self) -> bool:
+    '''
+    Loads the snapshot file if it exists and has changed since last loaded.
+
+    Returns: bool
+      True if a valid snapshot is loaded.
+    '''
+    if not self._file.changed():
+      with self._lock:
+        return self._data is not None
+
+    try:
+      with open(self.path, "rb") as f:
+        raw = f.read()
+      magic, fmt, version, length, crc = self.HEADER.unpack_from(raw)
+      payload = raw[self.HEADER.size:]
+      if magic != self.MAGIC or fmt != self.FORMAT or \
+          len(payload) != length or zlib.crc32(payload) != crc:
+        log.warning("ignoring snapshot %s: bad header or checksum", \
+            self.path)
+        return False
+      data = json.loads(payload, object_hook = self._unpair)
+    except (OSError, ValueError, struct.error) as e:
+      log.warning("ignoring snapshot %s: %s", self.path, e)
+      return False
+
+    with self._lock:
+      self._data = data
+      self.version = version
+
+    return True
+
+  def write(self) -> int:
+    '''
+    Computes all aggregates with live queries and writes them, replacing
+    the previous snapshot.  Runs after each DataLoader load.  Queries go to
+    the primary through db.session, since replicas and the analytics copy
+    may not have the load yet.
+
+    Returns: int
+      Data version written.
+    '''
+    from .db_handler import PrimaryDBHandler
+    from .models import Horse, Jockey, Trainer
+    dbh = PrimaryDBHandler()
+    version = dbh.data_version()
+    parties = {"sires": Horse, "jockeys": Jockey, "trainers": Trainer}
+    data = {"total": dbh.total_indexed, "aggregates": {measure: \
+        self._plain(dbh.all_aggregate_wins(parties[measure], live = True)) \
+        for measure in self.MEASURES}}
+    payload = json.dumps(data, separators = (",", ":")).encode()
+
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+    tmp = self.path + ".tmp"
+    with open(tmp, "wb") as f:
+      f.write(self.HEADER.pack(self.MAGIC, self.FORMAT, version, \
+          len(payload), zlib.crc32(payload)))
+      f.write(payload)
+    os.replace(tmp, self.path)
+    self.load()
+
+    return version
+
+  def _current(self, version: int) -> dict | None:
+    self.load()
+    with self._lock:
+      if self._data is None or self.version != version:
+        return None
+
+      return self._data
+
+  def _plain(self, value):
+    if isinstance(value, dict):
+      if all(isinstance(key, str) for key in value):
+        return {key: self._plain(item) for key, item in value.items()}
+      # JSON object keys are strings, so win counts are kept as pairs.
+      return {"__pairs__": [[key, self._plain(item)] \
+          for key, item in value.items()]}
+    if isinstance(value, list):
+      return [self._plain(item) for item in value]
+    if hasattr(value, "_asdict"):
+      return {key: str(item) if isinstance(item, uuid.UUID) else item \
+          for key, item in value._asdict().items()}
+
+    return value
+
+  def _unpair(self, obj: dict) -> dict:
+    if len(obj) == 1 and "__pairs__" in obj:
+      return {key: item for key, item in obj["__pairs__"]}
+
+    return obj
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+class StatsEngine(object):
+  '''
+  Computes wins, share of wins, and average winning odds for every sire,
+  jockey, and trainer in one vectorized pass over all winning entries.
+  Parties are factorized into integer codes once when the engine is built,
+  so each breakdown is a single bincount over (party code, group code)
+  pairs rather than one SQL query per party.
+
+  The Keeneland data records only the winner of each race, so a party's
+  starts (and with them strike rate and flat-bet ROI) are not known.  Share
+  is a party's fraction of all the wins in a group, and average winning
+  odds is the mean price of those wins.
+
+  Attributes:
+    SURFACES: list[str]
+      Surfaces broken out in the surface breakdown.
+
+    DISTANCES: list[str]
+      Distance classes; a sprint is 7 furlongs or less, consistent with
+      DBHandler.wins_by_distance.
+
+    ODDS_BANDS: dict[str, tuple[float, float]]
+      Lower (inclusive) and upper (exclusive) odds for each odds band.
+
+    BREAKDOWNS: list[str]
+      Names of the available breakdowns.
+
+  Methods:
+    __init__(rows):
+      Builds party codes and group codes from raw winning entry rows.
+
+    rates(measure, breakdown, min_wins, top):
+      Wins, share, and average winning odds per party for every group in a
+      breakdown.
+
+    all_rates(measure, min_wins, top):
+      Combines rates() for every breakdown.
+
+    _factorize(values):
+      Converts a sequence of ids into integer codes.
+  '''
+  SURFACES = ["Dirt", "Turf", "Polytrack"]
+  DISTANCES = ["sprint", "route"]
+  ODDS_BANDS = {"favorite": (0, 2), "contender": (2, 5), \
+      "midpack": (5, 10), "longshot": (10, np.inf)}
+  BREAKDOWNS = ["all_time", "surface", "distance", "odds"]
+
+  def __init__(self, rows: list) -> None:
+    '''
+    Parameters:
+      rows: list
+        One row per winning entry with columns (jockey_id, trainer_id,
+        sire_id, odds, surface, distance).  Missing ids and odds may be
+        None.
+    '''
+    count = len(rows)
+    if count:
+      jockeys, trainers, sires, odds, surfaces, distances = zip(*rows)
+    else:
+      jockeys = trainers = sires = odds = surfaces = distances = ()
+
+    self.parties = {"jockeys": self._factorize(jockeys), \
+        "trainers": self._factorize(trainers), \
+        "sires": self._factorize(sires)}
+
+    self.odds = np.fromiter((np.nan if o is None else o for o in odds), \
+        dtype = float, count = count)
+    distance = np.fromiter((np.nan if d is None else d for d in distances), \
+        dtype = float, count = count)
+
+    surface_codes = {s: i for i, s in enumerate(self.SURFACES)}
+    surface = np.fromiter((surface_codes.get(s, -1) for s in surfaces), \
+        dtype = np.int64, count = count)
+    dist_class = np.where(np.isnan(distance), -1, \
+        np.where(distance <= 7, 0, 1))
+    edges = [low for low, _ in self.ODDS_BANDS.values()][1:]
+    odds_band = np.where(np.isnan(self.odds), -1, \
+        np.digitize(np.nan_to_num(self.odds), edges))
+
+    self.groups = {"all_time": (np.zeros(count, dtype = np.int64), \
+        ["all_time"]), \
+        "surface": (surface, self.SURFACES), \
+        "distance": (dist_class, self.DISTANCES), \
+        "odds": (odds_band, list(self.ODDS_BANDS))}
+
+  def rates(self, measure: str, breakdown: str, min_wins: int = 3, \
+      top: int = 10) -> dict[str, list[dict]]:
+    '''
+    Finds the parties with the most wins in each group of a breakdown.
+
+    Parameters:
+      measure: str
+        One of "sires", "jockeys", or "trainers".
+      breakdown: str
+        One of BREAKDOWNS.
+      min_wins: int
+        Parties with fewer wins in a group are left out of that group.
+      top: int
+        Number of parties returned per group.
+
+    Returns: dict[str, list[dict]]
+      For each group label, rows with the party id, wins, share of the
+      group's wins, and average winning odds (None without known odds),
+      ordered by wins then average winning odds.
+    '''
+    codes, ids = self.parties[measure]
+    groups, labels = self.groups[breakdown]
+    size = len(ids) * len(labels)
+
+    keep = (codes >= 0) & (groups >= 0)
+    key = codes[keep] * len(labels) + groups[keep]
+    odds = self.odds[keep]
+    priced = ~np.isnan(odds)
+
+    shape = (len(ids), len(labels))
+    wins = np.bincount(key, minlength = size).reshape(shape)
+    group_wins = np.bincount(groups[groups >= 0], minlength = len(labels))
+    counted = np.bincount(key, weights = priced, minlength = size) \
+        .reshape(shape)
+    total_odds = np.bincount(key, weights = np.where(priced, odds, 0), \
+        minlength = size).reshape(shape)
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+      share = wins / group_wins
+      avg_odds = total_odds / counted
+
+    by_group = {}
+    for col, label in enumerate(labels):
+      eligible = np.flatnonzero(wins[:, col] >= min_wins)
+      order = np.lexsort((-np.nan_to_num(avg_odds[eligible, col]), \
+          -wins[eligible, col]))
+      by_group[label] = [{"id": ids[i], "wins": int(wins[i, col]), \
+          "share": float(share[i, col]), \
+          "avg_odds": None if np.isnan(avg_odds[i, col]) else \
+          float(avg_odds[i, col])} for i in eligible[order][:top]]
+
+    return by_group
+
+  def all_rates(self, measure: str, min_wins: int = 3, \
+      top: int = 10) -> dict[str, dict[str, list[dict]]]:
+    return {breakdown: self.rates(measure, breakdown, min_wins, top) \
+        for breakdown in self.BREAKDOWNS}
+
+  def _factorize(self, values) -> tuple[np.ndarray, list]:
+    '''
+    Assigns each distinct id an integer code in order of first appearance.
+    Missing ids are coded as -1 and excluded from every breakdown.
+
+    Returns: tuple[np.ndarray, list]
+      Code for each value and the id for each code.
+    '''
+    lookup = {}
+    codes = np.fromiter((-1 if v is None else lookup.setdefault(v, \
+        len(lookup)) for v in values), dtype = np.int64, count = len(values))
+
+    return codes, list(lookup)
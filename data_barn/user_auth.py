@@ -1,8 +1,8 @@
 from flask import Blueprint, request, render_template, flash, url_for, redirect, session
 from sqlalchemy import select, exc
-from werkzeug.security import check_password_hash, generate_password_hash
 from flask_login import login_user, current_user, logout_user
-from . import db
+from . import db, password_hasher, login_throttle
+from .passwords import HasherBusy
 from .models import User
 from .dbarn_forms import LogInForm, RegisterForm
 
@@ -11,7 +11,9 @@ bp = Blueprint("auth", __name__, url_prefix = "/auth")
 @bp.route("/login", methods = ("GET", "POST"))
 def user_login() -> str:
   '''
-  Handles log in workflow, including authentication.
+  Handles log in workflow, including authentication.  Repeated failures
+  for a user name or client address are rejected before the password is
+  hashed, and hashing itself runs on the bounded password_hasher pool.
   '''
   login_form = LogInForm()
   username = None
@@ -24,18 +26,37 @@ def user_login() -> str:
     login_form.password.data= ""
   
     error = None
+    throttle_keys = [f'user:{username}', f'ip:{request.remote_addr}']
     if username and password:
+      if login_throttle.retry_after(throttle_keys):
+        error = 'Too many failed log in attempts.  Please try again later.'
+        flash(error, "error")
+        return render_template("auth/login.html", username = username, \
+          password = None, form = login_form), 429
+
       entry = db.session.execute(db.select(User).filter_by(name = username)) \
           .scalars().first()
       if entry:
-        if check_password_hash(entry.password, password):
+        try:
+          verified = password_hasher.verify(entry.password, password)
+        except HasherBusy:
+          error = 'The server is busy.  Please try again in a moment.'
+          flash(error, "error")
+          return render_template("auth/login.html", username = username, \
+            password = None, form = login_form), 503
+
+        if verified:
+          login_throttle.reset(throttle_keys[0])
+          session.regenerate()
           login_user(entry, remember = True)
           if current_user.is_authenticated:
             return redirect(url_for("dashboard"))
         else:
+          login_throttle.record_failure(throttle_keys)
           error = f'Incorrect password.  Please try again.'
           flash(error, "error")
       else:
+        login_throttle.record_failure(throttle_keys)
         error = f'User {username} does not exist.  Please try again.'
         flash(error, "error")
   return render_template("auth/login.html", username = username, \
@@ -59,7 +80,15 @@ def user_register() -> str:
 
     error = None
     if username and password:
-      current_login = User(name = username, password = generate_password_hash(password))
+      try:
+        pwhash = password_hasher.hash(password)
+      except HasherBusy:
+        error = 'The server is busy.  Please try again in a moment.'
+        flash(error, "error")
+        return render_template("auth/register.html", username = username, \
+          password = None, form = register_form), 503
+
+      current_login = User(name = username, password = pwhash)
       try:
         db.session.add(current_login)
         db.session.commit()
@@ -79,9 +108,11 @@ def user_register() -> str:
 @bp.route("/logout", methods = ("GET", "POST"))
 def user_logout():
   '''
-  Ends user session.
+  Ends user session.  The session moves to a new id so the one used while
+  logged in cannot be replayed.
   '''
   logout_user()
+  session.regenerate()
   return redirect(url_for("auth.user_login"))
 
 
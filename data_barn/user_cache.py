@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+class UserCache(object):
+  '''
+  Small thread-safe LRU cache with a time-to-live, used by the flask_login
+  user loader so authenticated requests do not have to select the user
+  record on every page load.  Entries are evicted least recently used first
+  once max_size is reached and are ignored once older than ttl seconds.
+
+  Attributes:
+    ttl: float
+      Seconds an entry remains valid after it is stored.
+
+    max_size: int
+      Maximum number of entries held.
+
+    hits, misses, evictions, invalidations: int
+      Counters for cache activity, reported by stats().
+
+  Methods:
+    init_app(app):
+      Reads USER_CACHE_TTL and USER_CACHE_SIZE from the app config.
+
+    get(key):
+      Returns the cached value for key, or None if missing or expired.
+
+    put(key, value):
+      Stores value under key, evicting the oldest entry if full.
+
+    invalidate(key):
+      Removes key from the cache.
+
+    clear():
+      Removes every entry.
+
+    stats():
+      Snapshot of the counters, current size, and hit rate.
+  '''
+  def __init__(self, ttl: float = 60.0, max_size: int = 1024) -> None:
+    self.ttl = ttl
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def init_app(self, app) -> None:
+    self.ttl = app.config.get("USER_CACHE_TTL", self.ttl)
+    self.max_size = app.config.get("USER_CACHE_SIZE", self.max_size)
+    self.clear()
+
+  def get(self, key):
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < now:
+        if entry is not None:
+          del self._entries[key]
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+
+      return entry[1]
+
+  def put(self, key, value) -> None:
+    expires = time.monotonic() + self.ttl
+    with self._lock:
+      self._entries[key] = (expires, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last = False)
+        self.evictions += 1
+
+  def invalidate(self, key) -> None:
+    with self._lock:
+      if self._entries.pop(key, None) is not None:
+        self.invalidations += 1
+
+  def clear(self) -> None:
+    with self._lock:
+      self.invalidations += len(self._entries)
+      self._entries.clear()
+
+  def stats(self) -> dict[str, float]:
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {"hits": self.hits, "misses": self.misses, \
+          "evictions": self.evictions, \
+          "invalidations": self.invalidations, \
+          "size": len(self._entries), \
+          "hit_rate": self.hits / lookups if lookups else 0.0}
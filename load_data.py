@@ -1,9 +1,15 @@
 import csv
+import logging
 from sqlalchemy import exc
-from data_barn import db, models
+from data_barn import db, models, profiler, analytics, aggregate_snapshot
+from data_barn import feature_store, changes
+from data_barn.figures import FigureBuilder
+from data_barn.metrics import track_method
 from datetime import date
 import uuid
 
+log = logging.getLogger("data_barn.load_data")
+
 class DataLoader(object):
   '''
   Helper class to load data from CSV file formatted in the style of the
@@ -30,12 +36,18 @@ class DataLoader(object):
       self.entries and creates necessary database records.
 
     batch_process():
-      Creates records for all dict items in self.entries
+      Creates records for all dict items in self.entries, refreshes
+      speed and pace figures for the race days that were loaded, exports
+      the analytics copy, writes the aggregate snapshot, adds the new
+      runnings to the handicapping features, and notifies the workers.
 
     _clean_name(person):
       Takes a person's names and splits it into first and last name for 
       database record (relevant to trainer and jockey).
 
+    _parse_date(mdy):
+      Converts a M/D/YYYY date from the CSV file into a date.
+
 
 
   '''
@@ -69,6 +81,7 @@ class DataLoader(object):
             .filter_by(abbreviation = "KEE")).fetchone()[0].id
 
 
+  @track_method
   def insert_horse(self, row: dict[str, str]) -> dict[str, uuid.UUID]:
     '''
     Given a dict from a row in the CSV file, inserts relevant records into 
@@ -142,6 +155,7 @@ class DataLoader(object):
 
     return {"horse": this_horse.id, "owner": owner_id, "trainer": trainer_id}
 
+  @track_method
   def insert_race(self, row: dict[str, str]) -> uuid.UUID:
     '''
     Inserts race record into table using relevant items from row in CSV file.
@@ -200,6 +214,7 @@ class DataLoader(object):
       return race.id
 
 
+  @track_method
   def insert_running(self, row: dict[str, str]) -> tuple[uuid.UUID, \
       dict[str, uuid.UUID]]:
     '''
@@ -225,8 +240,7 @@ class DataLoader(object):
     half_mile = float(row["HalfMileTime"])
     final = float(row["FinalTime"])
     half_winner = float(row["HalfMilePosition"])
-    ran_on = row["RaceDate"].split("/")
-    ran_date = date(int(ran_on[2]), int(ran_on[0]), int(ran_on[1]))
+    ran_date = self._parse_date(row["RaceDate"])
     win_post = int(row["WinningPostPosition"])
     run = models.Running(race_id = race, date = ran_date, \
         half_mile_seconds = half_mile, \
@@ -239,6 +253,7 @@ class DataLoader(object):
 
     return run.id, winner_stats
 
+  @track_method
   def insert_jockey(self, row: dict[str, str]) -> uuid.UUID:
     '''
     Inserts record into jockey table if none exists or returns existing entry.
@@ -267,6 +282,7 @@ class DataLoader(object):
 
     return j.id
 
+  @track_method
   def insert_track(self, abbrv: str) -> uuid.UUID:
     '''
     Inserts track into database or returns ID if record exists.  Depends on 
@@ -296,6 +312,7 @@ class DataLoader(object):
       return new_track.id
     
 
+  @track_method
   def insert_entry(self, row: dict[str, str], run: uuid.UUID, \
       winner: dict[str, uuid.UUID]) -> tuple[uuid.UUID, uuid.UUID]:
     '''
@@ -354,15 +371,47 @@ class DataLoader(object):
     return horse, run
 
 
+  @profiler.profile_job
+  @track_method
   def batch_process(self) -> None:
     '''
     Breaks out relevant database records from each row in the CSV for the 
     original dataset (self.entries).  Creates a running record (individual
-    instance of a race) and an entry record (past performance).
+    instance of a race) and an entry record (past performance).  Figures
+    are recomputed only for the race days touched by this load, the load
+    is recorded in data_load to move the data version on, the DuckDB
+    analytics copy is re-exported if one is configured, the
+    aggregate snapshot is rewritten for new workers, the new runnings
+    are added to the handicapping features, and running workers are
+    notified of the new data version.  Those last steps only derive copies
+    of committed data, so one failing is logged and the rest still run;
+    rerun it with its flask command.
     '''
+    race_days = set()
     for e in self.entries:
       running_id, winner_info = self.insert_running(e)
       _, _ = self.insert_entry(e, running_id, winner_info)
+      race_days.add(self._parse_date(e["RaceDate"]))
+
+    FigureBuilder().refresh(race_days)
+    # Recorded once everything but the derived copies is written, so the
+    # new data version only appears once the load is complete.
+    load = models.DataLoad(entries = len(self.entries))
+    db.session.add(load)
+    db.session.commit()
+    version = load.id
+    steps = [("snapshot", aggregate_snapshot.write), \
+        ("features", feature_store.refresh), \
+        ("notification", lambda: changes.publish(changes.DATA_TABLES, \
+            version))]
+    if analytics.uri is not None:
+      steps.insert(0, ("analytics export", analytics.export))
+    for name, step in steps:
+      try:
+        step()
+      except Exception:
+        log.exception("load %d: %s failed", version, name)
+        db.session.rollback()
 
 
 
@@ -400,3 +449,17 @@ class DataLoader(object):
 
 
   
+
+  def _parse_date(self, mdy: str) -> date:
+    '''
+    Converts a date string from the original dataset into a date.
+
+    Parameters:
+      mdy: str
+        Date in M/D/YYYY format
+
+    Returns: date
+    '''
+    month, day, year = mdy.strip().split("/")
+
+    return date(int(year), int(month), int(day))
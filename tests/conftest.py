@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.compiler import compiles
+
+@compiles(UUID, "sqlite")
+def _sqlite_uuid(type_, compiler, **kw):
+  # Lets the PostgreSQL models create tables in a throwaway SQLite database.
+  return "CHAR(32)"
+
+@pytest.fixture
+def app(tmp_path):
+  from data_barn import create_app, db
+
+  app = create_app({"TESTING": True, \
+      "SQLALCHEMY_DATABASE_URI": f'sqlite:///{tmp_path / "test.db"}', \
+      "SESSION_TYPE": "memory", \
+      "SNAPSHOT_PATH": str(tmp_path / "aggregates.snap"), \
+      "FEATURES_PATH": str(tmp_path / "features.npz")})
+  with app.app_context():
+    db.create_all()
+  yield app
+  with app.app_context():
+    db.session.remove()
+    for engine in db.engines.values():
+      engine.dispose()
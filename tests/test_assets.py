@@ -0,0 +1,25 @@
+import pytest
+from data_barn.assets import build_assets
+
+def test_build_only_replaces_its_own_output(tmp_path):
+  '''
+  build_assets refuses to clear the static folder, a folder containing it,
+  or a folder that is not an earlier build, and rebuilds over its output.
+  '''
+  static = tmp_path / "static"
+  static.mkdir()
+  (static / "site.css").write_text("body { margin: 0; }\n" * 20)
+  other = tmp_path / "other"
+  other.mkdir()
+  (other / "notes.txt").write_text("keep me")
+
+  for out in (static, tmp_path, other):
+    with pytest.raises(ValueError):
+      build_assets(str(static), str(out))
+  assert (static / "site.css").exists()
+  assert (other / "notes.txt").exists()
+
+  dist = static / "dist"
+  manifest = build_assets(str(static), str(dist))
+  assert build_assets(str(static), str(dist)) == manifest
+  assert (dist / manifest["site.css"]).exists()
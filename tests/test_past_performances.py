@@ -0,0 +1,71 @@
+import datetime
+from sqlalchemy import event
+from data_barn import db
+from data_barn.models import Entry, Horse, Jockey, Race, Running, Trainer, \
+    User
+
+def seed_histories(lengths: list[int]) -> list:
+  '''
+  Adds one horse per length in lengths, each with that many starts under
+  the same jockey and trainer, and returns the horses' ids.
+  '''
+  jockey = Jockey(first_name = "Julien", last_name = "Leparoux")
+  trainer = Trainer(first_name = "Ken", last_name = "McPeek")
+  race = Race(type = "Allowance", distance = 8.5, surface = "Dirt")
+  db.session.add_all([jockey, trainer, race])
+  db.session.flush()
+
+  horse_ids = []
+  day = datetime.date(2014, 4, 1)
+  for length in lengths:
+    horse = Horse(name = f'Horse {length}', trainer_id = trainer.id)
+    db.session.add(horse)
+    db.session.flush()
+    for start in range(length):
+      running = Running(race_id = race.id, winner_id = horse.id, \
+          date = day + datetime.timedelta(days = start), num_on_day = 1, \
+          field_size = 8, half_mile_seconds = 47.5, final_seconds = 104.2)
+      db.session.add(running)
+      db.session.flush()
+      db.session.add(Entry(horse_id = horse.id, running_id = running.id, \
+          jockey_id = jockey.id, trainer_id = trainer.id, \
+          post_position = 1 + start % 8, odds = 3.5))
+    horse_ids.append(horse.id)
+  db.session.add(User(name = "tester", password = "unused"))
+  db.session.commit()
+
+  return horse_ids
+
+def test_past_performances_query_count_is_constant(app):
+  '''
+  A history page issues the same number of statements however many starts
+  it lists.
+  '''
+  lengths = [1, 3, 12]
+  with app.app_context():
+    horse_ids = seed_histories(lengths)
+    user_id = db.session.execute(db.select(User.id)).scalar_one().hex
+    engine = db.engine
+
+  statements = []
+  def count(conn, cursor, statement, params, context, many) -> None:
+    statements.append(statement)
+  event.listen(engine, "after_cursor_execute", count)
+
+  client = app.test_client()
+  with client.session_transaction() as session:
+    session["_user_id"] = user_id
+    session["_fresh"] = True
+  # The first request loads the user into the user cache.
+  assert client.get(f'/history/horses/{horse_ids[0].hex}').status_code == 200
+
+  counts = []
+  for length, horse_id in zip(lengths, horse_ids):
+    statements.clear()
+    response = client.get(f'/history/horses/{horse_id.hex}')
+    assert response.status_code == 200
+    assert response.data.count(b"Won") == length
+    counts.append(len(statements))
+  event.remove(engine, "after_cursor_execute", count)
+
+  assert len(set(counts)) == 1, counts
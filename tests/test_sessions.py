@@ -0,0 +1,22 @@
+def test_static_files_skip_the_session(app):
+  '''
+  Static files neither read the session store nor vary on the cookie,
+  while pages that use the session do.
+  '''
+  client = app.test_client()
+  with client.session_transaction() as session:
+    session["_user_id"] = "0" * 32
+
+  store = app.session_interface.store
+  loads = []
+  load = store.load
+  store.load = lambda sid, now: loads.append(sid) or load(sid, now)
+
+  response = client.get("/static/login.css")
+  assert response.status_code == 200
+  assert "Cookie" not in response.vary
+  assert loads == []
+
+  response = client.get("/")
+  assert "Cookie" in response.vary
+  assert len(loads) == 1